@@ -0,0 +1,177 @@
+"""
+Offline pipeline benchmarks on synthetic receipts.
+
+    python -m scripts.bench                                  # default matrix, print results
+    python -m scripts.bench --save bench/baseline.json       # record a baseline
+    python -m scripts.bench --compare bench/baseline.json    # exit 1 if any case regressed
+"""
+import argparse
+import io
+import json
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable
+
+from src.bench.synthetic import item_names, mapping_rows, receipt, receipt_image
+from src.bot.handlers import ReceiptService
+from src.config import PreprocessConfig
+from src.db.db import connect, init_db
+from src.db.repo import Repo
+from src.mapping.cache import MappingCache
+from src.mapping.fuzzy import FuzzyIndex
+from src.mapping.normalize import normalize_item_name
+from src.parsing.detect_store import detect_store
+from src.parsing.registry import registry
+
+
+def timeit(fn: Callable[[], object], repeat: int) -> dict[str, float]:
+    fn()  # warm-up
+    samples = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - t0) * 1000)
+    samples.sort()
+    return {
+        "median_ms": round(statistics.median(samples), 4),
+        "p95_ms": round(samples[min(len(samples) - 1, int(len(samples) * 0.95))], 4),
+        "n": repeat,
+    }
+
+
+def seed_db(tmp: Path, n_mappings: int) -> tuple[Repo, int, list[str]]:
+    conn = connect(tmp / "bench.db")
+    init_db(conn)
+    repo = Repo(conn)
+    user_id = repo.get_or_create_user("bench", default_account="Cash")
+    names = item_names(n_mappings)
+    with conn:
+        conn.executemany(
+            """INSERT INTO item_mappings (user_id, normalized_key, canonical_name, category, subcategory)
+               VALUES (?, ?, ?, ?, ?)""",
+            [(user_id, normalize_item_name(raw), canon, cat, sub) for raw, canon, cat, sub in mapping_rows(names)],
+        )
+    return repo, user_id, names
+
+
+def run_matrix(line_counts: list[int], mapping_counts: list[int], repeat: int, images: bool) -> dict[str, dict]:
+    results: dict[str, dict] = {}
+
+    for n_mappings in mapping_counts:
+        with tempfile.TemporaryDirectory() as tmp:
+            repo, user_id, names = seed_db(Path(tmp), n_mappings)
+            mappings = MappingCache(repo, max_entries=max(n_mappings * 2, 50_000))
+            fuzzy = FuzzyIndex(mappings)
+            service = ReceiptService(repo=repo, ocr=None, downloads_dir=Path(tmp), mappings=mappings, fuzzy=fuzzy)
+
+            for n_lines in line_counts:
+                tag = f"[lines={n_lines},mappings={n_mappings}]"
+                noisy = receipt("WALMART", n_lines, names, seed=n_lines, noise=0.1)
+                clean = receipt("SAMS", n_lines, names, seed=n_lines + 1, noise=0.0)
+                raw_names = [pl.raw_name for pl in registry.get("WALMART").parse(noisy)]
+                keys = [normalize_item_name(n) for n in raw_names]
+
+                def record(case: str, fn: Callable[[], object]) -> None:
+                    results[f"{case}{tag}"] = timeit(fn, repeat)
+                    print(f"{case + tag:<55} {results[case + tag]['median_ms']:>10.3f} ms", file=sys.stderr)
+
+                record("normalize", lambda: [normalize_item_name(n) for n in raw_names])
+                record("detect_store", lambda: detect_store(noisy))
+                record("parse_walmart", lambda: registry.get("WALMART").parse(noisy))
+                record("parse_sams", lambda: registry.get("SAMS").parse(clean))
+
+                record("lookup_db", lambda: repo.find_mappings(user_id, keys))
+                mappings.resolve(user_id, keys)  # load outside the timed region
+                record("lookup_cache", lambda: mappings.resolve(user_id, keys))
+                unknown = [k for k in keys if k not in mappings.resolve(user_id, keys)] or keys[:1]
+                record("fuzzy_suggest", lambda: [fuzzy.suggest(user_id, k) for k in unknown])
+
+                parsed = registry.get("WALMART").parse(noisy)
+
+                def ingest() -> None:
+                    sid = repo.create_session(user_id, "Cash", "01/15/2026", None)
+                    ids = mappings.resolve(user_id, [normalize_item_name(pl.raw_name) for pl in parsed])
+                    repo.ingest_lines(sid, user_id, parsed, mapping_ids=ids)
+
+                record("repo_ingest", ingest)
+
+                sid = service.process_receipt(user_id, "Cash", None, clean).session_id
+                record("export_tsv", lambda: service.export_tsv(user_id, sid))
+
+                def end_to_end() -> None:
+                    result = service.process_receipt(user_id, "Cash", None, clean)
+                    service.write_session_tsv(user_id, result.session_id, io.BytesIO())
+
+                record("end_to_end", end_to_end)
+
+                if images:
+                    from src.ocr.preprocess import preprocess_image
+
+                    photo = receipt_image(clean, seed=n_lines)
+                    record("preprocess", lambda: preprocess_image(photo, PreprocessConfig()))
+
+            repo.conn.close()
+    return results
+
+
+def compare(results: dict[str, dict], baseline: dict[str, dict], tolerance: float) -> list[str]:
+    regressions = []
+    print(f"{'case':<55} {'baseline':>10} {'now':>10} {'change':>8}")
+    for name, now in sorted(results.items()):
+        base = baseline.get(name)
+        if base is None:
+            print(f"{name:<55} {'-':>10} {now['median_ms']:>10.3f} {'new':>8}")
+            continue
+        change = (now["median_ms"] - base["median_ms"]) / base["median_ms"] if base["median_ms"] else 0.0
+        flag = ""
+        if change > tolerance:
+            flag = "  REGRESSION"
+            regressions.append(name)
+        print(f"{name:<55} {base['median_ms']:>10.3f} {now['median_ms']:>10.3f} {change:>+7.0%}{flag}")
+    return regressions
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--lines", default="10,100,500", help="receipt sizes (comma separated)")
+    ap.add_argument("--mappings", default="1000,10000", help="mappings per user (comma separated)")
+    ap.add_argument("--repeat", type=int, default=20)
+    ap.add_argument("--images", action="store_true", help="also time image preprocessing (needs Pillow)")
+    ap.add_argument("--save", type=Path, help="write results as a JSON baseline")
+    ap.add_argument("--compare", type=Path, help="baseline JSON to compare against")
+    ap.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown before a case counts as a regression")
+    args = ap.parse_args()
+
+    results = run_matrix(
+        [int(x) for x in args.lines.split(",")],
+        [int(x) for x in args.mappings.split(",")],
+        args.repeat,
+        args.images,
+    )
+
+    if args.save:
+        args.save.parent.mkdir(parents=True, exist_ok=True)
+        payload = {
+            "meta": {"python": platform.python_version(), "machine": platform.machine(), "repeat": args.repeat},
+            "results": results,
+        }
+        args.save.write_text(json.dumps(payload, indent=2, sort_keys=True), encoding="utf-8")
+        print("baseline written to", args.save, file=sys.stderr)
+
+    if args.compare:
+        baseline = json.loads(args.compare.read_text(encoding="utf-8"))["results"]
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f"{len(regressions)} regression(s)", file=sys.stderr)
+            sys.exit(1)
+    elif not args.save:
+        json.dump(results, sys.stdout, indent=2, sort_keys=True)
+        print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,389 @@
+"""
+A local stand-in for the Telegram Bot API, for end-to-end runs without Telegram.
+
+    python -m scripts.fake_telegram --port 8081 receipt1.jpg receipt2.jpg
+
+Point the bot at it with `telegram.api_base_url: "http://127.0.0.1:8081"` (any bot_token works).
+It implements the methods the bot uses, delivers each photo as an update (pushed to the webhook
+if one is set, otherwise handed out by getUpdates) and prints the latency until the bot replies.
+
+With --chat-limit / --global-limit it answers 429 "retry after" like Telegram's flood control
+does, and --chats sends every photo from that many chats at once to produce a burst.
+"""
+import argparse
+import email.parser
+import email.policy
+import itertools
+import json
+import logging
+import sys
+import threading
+import time
+from collections import deque
+import urllib.error
+import urllib.request
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Callable, Optional
+from urllib.parse import parse_qsl
+
+log = logging.getLogger(__name__)
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "Fake", "username": "fake_receipt_bot"}
+BOT_MESSAGE_METHODS = {"sendMessage", "sendDocument", "editMessageText"}
+
+
+@dataclass
+class Call:
+    method: str
+    params: dict[str, Any]
+    files: dict[str, bytes] = field(default_factory=dict)
+    at: float = field(default_factory=time.perf_counter)
+
+
+class ApiError(Exception):
+    def __init__(self, code: int, description: str, parameters: Optional[dict] = None):
+        super().__init__(description)
+        self.code = code
+        self.description = description
+        self.parameters = parameters
+
+
+class FakeTelegram:
+    """
+    In-process fake Bot API server. `calls` records every request the bot made, `flooded` the
+    ones refused with 429 because they went over chat_limit / global_limit messages per second.
+    """
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        chat_limit: Optional[int] = None,
+        global_limit: Optional[int] = None,
+        retry_after: int = 1,
+    ):
+        self.calls: list[Call] = []
+        self.flooded: list[Call] = []
+        self.chat_limit = chat_limit
+        self.global_limit = global_limit
+        self.retry_after = retry_after
+        self._sent: dict[str, deque[float]] = {}   # chat_id -> times of its last messages
+        self._sent_all: deque[float] = deque()
+        self.webhook_url: Optional[str] = None
+        self.webhook_secret: Optional[str] = None
+        self.allowed_updates: Optional[list[str]] = None
+        self.files: dict[str, bytes] = {}
+        self._updates: list[dict] = []          # waiting for getUpdates
+        self._cond = threading.Condition()
+        self._ids = itertools.count(1)
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fake-telegram", daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "FakeTelegram":
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    # ---------- driving the bot ----------
+    def send_photo(
+        self, chat_id: int, data: bytes, caption: Optional[str] = None, media_group_id: Optional[str] = None
+    ) -> int:
+        """
+        Deliver a photo message from user `chat_id`. Returns its message_id.
+        """
+        n = next(self._ids)
+        file_id = f"photo{n}"
+        self.files[file_id] = data
+        message = self._message(chat_id, from_user=True)
+        message["photo"] = [
+            {"file_id": file_id, "file_unique_id": f"u{file_id}", "width": 1000, "height": 2000, "file_size": len(data)}
+        ]
+        if caption:
+            message["caption"] = caption
+        if media_group_id:
+            message["media_group_id"] = media_group_id
+        self.deliver({"update_id": n, "message": message})
+        return message["message_id"]
+
+    def send_command(self, chat_id: int, text: str) -> int:
+        n = next(self._ids)
+        message = self._message(chat_id, from_user=True)
+        message["text"] = text
+        command = text.split()[0]
+        message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(command)}]
+        self.deliver({"update_id": n, "message": message})
+        return message["message_id"]
+
+    def deliver(self, update: dict) -> None:
+        kind = next(k for k in update if k != "update_id")
+        if self.allowed_updates and kind not in self.allowed_updates:
+            return  # Telegram wouldn't send it either
+        if self.webhook_url:
+            req = urllib.request.Request(
+                self.webhook_url,
+                data=json.dumps(update).encode("utf-8"),
+                headers={"Content-Type": "application/json", "X-Telegram-Bot-Api-Secret-Token": self.webhook_secret or ""},
+            )
+            # like Telegram, retry while the webhook isn't reachable (setWebhook may precede the listener)
+            for attempt in range(50):
+                try:
+                    urllib.request.urlopen(req, timeout=10).close()
+                    return
+                except urllib.error.URLError as e:
+                    if isinstance(e, urllib.error.HTTPError) or attempt == 49:
+                        raise
+                    time.sleep(0.1)
+        else:
+            with self._cond:
+                self._updates.append(update)
+                self._cond.notify_all()
+
+    def wait_for_messages(
+        self,
+        chat_id: int,
+        count: int = 1,
+        since: float = 0.0,
+        timeout: float = 60.0,
+        match: Optional[Callable[[Call], bool]] = None,
+    ) -> list[Call]:
+        """
+        Block until the bot has sent (or edited) `count` messages to `chat_id` after `since` (a perf_counter
+        time), only counting the ones `match` accepts if given.
+        """
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while True:
+                sent = [
+                    c for c in self.calls
+                    if c.method in BOT_MESSAGE_METHODS and c.at >= since and str(c.params.get("chat_id")) == str(chat_id)
+                    and (match is None or match(c))
+                ]
+                if len(sent) >= count:
+                    return sent[:count]
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError(f"bot sent {len(sent)} of {count} messages to chat {chat_id}")
+                self._cond.wait(remaining)
+
+    def wait_until_ready(self, timeout: float = 30.0) -> None:
+        """
+        Block until the bot has connected (set a webhook or started polling).
+        """
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while not any(c.method in ("setWebhook", "getUpdates") for c in self.calls):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError("bot did not connect")
+                self._cond.wait(remaining)
+
+    # ---------- Bot API ----------
+    def _message(self, chat_id: int, from_user: bool) -> dict:
+        message = {
+            "message_id": next(self._ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+        }
+        if from_user:
+            message["from"] = {"id": chat_id, "is_bot": False, "first_name": "User"}
+        return message
+
+    def _throttle(self, call: Call) -> None:
+        """
+        Refuse a message over the configured limits with 429, as Telegram's flood control does.
+        """
+        if call.method not in BOT_MESSAGE_METHODS:
+            return
+        chat = self._sent.setdefault(str(call.params.get("chat_id")), deque())
+        for times in (chat, self._sent_all):
+            while times and times[0] <= call.at - 1.0:
+                times.popleft()
+        if (self.chat_limit and len(chat) >= self.chat_limit) or (self.global_limit and len(self._sent_all) >= self.global_limit):
+            raise ApiError(429, f"Too Many Requests: retry after {self.retry_after}", {"retry_after": self.retry_after})
+        chat.append(call.at)
+        self._sent_all.append(call.at)
+
+    def _call(self, method: str, params: dict[str, Any], files: dict[str, bytes]) -> Any:
+        if method == "getMe":
+            return BOT_USER
+        if method == "setWebhook":
+            self.webhook_url = params["url"] or None
+            self.webhook_secret = params.get("secret_token")
+            self.allowed_updates = params.get("allowed_updates")
+            return True
+        if method == "deleteWebhook":
+            self.webhook_url = None
+            return True
+        if method == "getWebhookInfo":
+            return {"url": self.webhook_url or "", "has_custom_certificate": False, "pending_update_count": 0}
+        if method == "getUpdates":
+            return self._get_updates(int(params.get("offset") or 0), float(params.get("timeout") or 0))
+        if method == "getFile":
+            file_id = params["file_id"]
+            if file_id not in self.files:
+                raise ApiError(400, "Bad Request: invalid file_id")
+            return {"file_id": file_id, "file_unique_id": f"u{file_id}", "file_size": len(self.files[file_id]), "file_path": file_id}
+        if method in ("sendMessage", "editMessageText"):
+            message = self._message(int(params["chat_id"]), from_user=False)
+            if method == "editMessageText":
+                message["message_id"] = int(params["message_id"])
+            message["text"] = params.get("text", "")
+            return message
+        if method == "sendDocument":
+            message = self._message(int(params["chat_id"]), from_user=False)
+            n = next(self._ids)
+            message["document"] = {"file_id": f"doc{n}", "file_unique_id": f"udoc{n}", "file_name": params.get("filename", "")}
+            return message
+        raise ApiError(404, f"Not Found: method {method}")
+
+    def _get_updates(self, offset: int, timeout: float) -> list[dict]:
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            self._updates = [u for u in self._updates if u["update_id"] >= offset]
+            while not self._updates and time.monotonic() < deadline:
+                self._cond.wait(deadline - time.monotonic())
+            return list(self._updates)
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self) -> None:
+                # /file/bot<token>/<file_path>
+                parts = self.path.split("/", 3)
+                if len(parts) == 4 and parts[1] == "file" and parts[3] in fake.files:
+                    self._send(200, fake.files[parts[3]], "application/octet-stream")
+                else:
+                    self.send_error(404)
+
+            def do_POST(self) -> None:
+                # /bot<token>/<method>
+                method = self.path.rstrip("/").rsplit("/", 1)[-1]
+                body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                params, files = _parse_body(self.headers.get("Content-Type", ""), body)
+                if method == "getUpdates":
+                    # allowed_updates of getUpdates applies like the setWebhook one
+                    if "allowed_updates" in params:
+                        fake.allowed_updates = params["allowed_updates"] or None
+                call = Call(method, params, files)
+                try:
+                    with fake._cond:
+                        fake._throttle(call)
+                        # recorded before answering: getUpdates may block for its long-poll timeout
+                        fake.calls.append(call)
+                        fake._cond.notify_all()
+                    result = fake._call(method, params, files)
+                except ApiError as e:
+                    if e.code == 429:
+                        with fake._cond:
+                            fake.flooded.append(call)
+                    status = e.code
+                    payload = {"ok": False, "error_code": e.code, "description": e.description}
+                    if e.parameters:
+                        payload["parameters"] = e.parameters
+                else:
+                    status = 200
+                    payload = {"ok": True, "result": result}
+                self._send(status, json.dumps(payload).encode("utf-8"), "application/json")
+
+            def _send(self, status: int, body: bytes, content_type: str) -> None:
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, fmt: str, *args) -> None:
+                log.debug("fake telegram: " + fmt, *args)
+
+        return Handler
+
+
+def _parse_body(content_type: str, body: bytes) -> tuple[dict[str, Any], dict[str, bytes]]:
+    """
+    Bot API parameters arrive form-encoded (multipart when files are attached); non-string values are JSON.
+    """
+    params: dict[str, Any] = {}
+    files: dict[str, bytes] = {}
+    if content_type.startswith("multipart/form-data"):
+        msg = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(
+            f"Content-Type: {content_type}\r\n\r\n".encode("latin-1") + body
+        )
+        for part in msg.iter_parts():
+            name = part.get_param("name", header="content-disposition")
+            if part.get_filename() is not None:
+                files[name] = part.get_payload(decode=True)
+            else:
+                params[name] = _value(part.get_payload(decode=True).decode("utf-8"))
+    elif content_type.startswith("application/json"):
+        params = json.loads(body or b"{}")
+    else:
+        params = {k: _value(v) for k, v in parse_qsl(body.decode("utf-8"))}
+    return params, files
+
+
+def _value(raw: str) -> Any:
+    try:
+        return json.loads(raw)
+    except ValueError:
+        return raw
+
+
+def _is_result(call: Call) -> bool:
+    # anything but the "Got it. Processing..." acknowledgement
+    return call.method != "sendMessage" or "Processing" not in str(call.params.get("text", ""))
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("photos", nargs="*", type=Path, help="receipt photos to send once the bot is connected")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8081)
+    ap.add_argument("--chat-id", type=int, default=1000)
+    ap.add_argument("--chats", type=int, default=1, help="send each photo from this many chats at once")
+    ap.add_argument("--timeout", type=float, default=120.0, help="seconds to wait for each reply")
+    ap.add_argument("--chat-limit", type=int, help="messages per second to one chat before answering 429")
+    ap.add_argument("--global-limit", type=int, help="messages per second to all chats before answering 429")
+    ap.add_argument("--retry-after", type=int, default=1, help="seconds the 429 answers ask to wait")
+    args = ap.parse_args()
+
+    fake = FakeTelegram(args.host, args.port, args.chat_limit, args.global_limit, args.retry_after).start()
+    print(f"fake Bot API on {fake.base_url}", file=sys.stderr)
+    try:
+        if not args.photos:
+            threading.Event().wait()
+        fake.wait_until_ready(timeout=300)
+        mode = "webhook" if fake.webhook_url else "polling"
+        chats = [args.chat_id + i for i in range(args.chats)]
+        for path in args.photos:
+            t0 = time.perf_counter()
+            for chat_id in chats:
+                fake.send_photo(chat_id, path.read_bytes())
+            for chat_id in chats:
+                # the acknowledgement, then the TSV / unknown items / error (which may replace it)
+                first, = fake.wait_for_messages(chat_id, 1, t0, args.timeout)
+                result, = fake.wait_for_messages(chat_id, 1, t0, args.timeout, match=_is_result)
+                print(
+                    f"{path.name} [chat {chat_id}]: first reply after {first.at - t0:.3f}s, "
+                    f"{result.method} after {result.at - t0:.3f}s ({mode})",
+                    flush=True,
+                )
+        print(f"{len(fake.flooded)} messages refused with 429", flush=True)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        fake.stop()
+
+
+if __name__ == "__main__":
+    main()
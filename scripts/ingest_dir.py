@@ -0,0 +1,172 @@
+"""
+Back-fill receipts from a directory of photos without going through Telegram.
+
+    python -m scripts.ingest_dir ./old_receipts --account Debit --out ./data/backfill.tsv
+
+OCR runs in a process pool. Sessions are written in batched transactions, and images that
+were already ingested (same SHA-256) are skipped, so an interrupted run can be restarted.
+"""
+import argparse
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from datetime import datetime
+from pathlib import Path
+from typing import Iterator, Optional
+
+from src.bot.handlers import ReceiptService
+from src.config import PreprocessConfig
+from src.db.db import connect, init_db
+from src.db.repo import Repo
+from src.ocr.ocr_cache import OCRCache, image_sha256
+from src.ocr.ocr_engine import OCREngine
+from src.ocr.ocr_result import OCRResult
+from src.pipeline.worker_pool import init_ocr_worker, ocr_in_worker
+
+IMAGE_SUFFIXES = {".jpg", ".jpeg", ".png", ".webp", ".heic", ".tif", ".tiff"}
+
+
+def find_images(root: Path) -> list[Path]:
+    return sorted(p for p in root.rglob("*") if p.is_file() and p.suffix.lower() in IMAGE_SUFFIXES)
+
+
+def _receipt_date(path: Path) -> str:
+    # best guess for old photos: file modification time
+    return datetime.fromtimestamp(path.stat().st_mtime).strftime("%m/%d/%Y")
+
+
+class Progress:
+    def __init__(self, total: int):
+        self.total = total
+        self.done = 0
+        self.failed = 0
+        self.t0 = time.perf_counter()
+
+    def tick(self, ok: bool) -> None:
+        self.done += 1
+        self.failed += 0 if ok else 1
+        elapsed = time.perf_counter() - self.t0
+        rate = self.done / elapsed if elapsed else 0.0
+        eta = (self.total - self.done) / rate if rate else 0.0
+        print(
+            f"\r[{self.done}/{self.total}] {rate:.2f} img/s, {self.failed} failed, eta {eta:.0f}s ",
+            end="", file=sys.stderr, flush=True,
+        )
+
+
+def ocr_results(
+    todo: list[tuple[Path, str]], workers: int, preprocess: Optional[PreprocessConfig]
+) -> Iterator[tuple[Path, str, Optional[OCRResult], Optional[BaseException]]]:
+    """
+    OCR images in a process pool, keeping at most 2 * workers images in memory. Yields in completion order.
+    """
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_ocr_worker, initargs=(OCREngine,)) as ex:
+        pending: dict[Future, tuple[Path, str]] = {}
+        queue = iter(todo)
+        while True:
+            while len(pending) < 2 * workers:
+                item = next(queue, None)
+                if item is None:
+                    break
+                path, sha = item
+                pending[ex.submit(ocr_in_worker, path.read_bytes(), preprocess)] = (path, sha)
+            if not pending:
+                return
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for fut in done:
+                path, sha = pending.pop(fut)
+                err = fut.exception()
+                yield path, sha, (None if err else fut.result().result), err
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("directory", type=Path)
+    ap.add_argument("--db", type=Path, default=Path("./data/app.db"))
+    ap.add_argument("--user", default="local", help="telegram user id to file the sessions under")
+    ap.add_argument("--account", default="Cash")
+    ap.add_argument("--workers", type=int, default=4)
+    ap.add_argument("--batch", type=int, default=25, help="sessions per transaction")
+    ap.add_argument("--no-preprocess", action="store_true")
+    ap.add_argument("--out", type=Path, help="write all resolved rows of the user to this TSV at the end")
+    args = ap.parse_args()
+
+    conn = connect(args.db)
+    init_db(conn)
+    repo = Repo(conn)
+    user_id = repo.get_or_create_user(args.user, default_account=args.account)
+
+    # one transaction per batch: the service and cache write through a non-committing Repo
+    batch_repo = Repo(conn, autocommit=False)
+    service = ReceiptService(repo=batch_repo, ocr=None, downloads_dir=args.directory)
+    ocr_cache = OCRCache(batch_repo, engine_version=OCREngine.VERSION)
+
+    images = find_images(args.directory)
+    hashes = {path: image_sha256(path.read_bytes()) for path in images}
+    already = repo.ingested_hashes(hashes.values())
+
+    todo: list[tuple[Path, str]] = []
+    cached: list[tuple[Path, str, OCRResult]] = []
+    seen: set[str] = set()
+    for path, sha in hashes.items():
+        if sha in already or sha in seen:
+            continue
+        seen.add(sha)
+        hit = ocr_cache.lookup_image(sha)
+        if hit is not None:
+            cached.append((path, sha, hit))
+        else:
+            todo.append((path, sha))
+
+    skipped = len(images) - len(todo) - len(cached)
+    print(f"{len(images)} images, {skipped} already ingested or duplicate, {len(cached)} with cached OCR, {len(todo)} to OCR", file=sys.stderr)
+
+    progress = Progress(len(todo) + len(cached))
+    pending_in_batch = 0
+
+    def ingest(path: Path, sha: str, result: OCRResult, store_ocr: bool) -> bool:
+        nonlocal pending_in_batch
+        if not conn.in_transaction:
+            # outside a transaction the savepoint would be the outermost one, and RELEASE would commit each image
+            conn.execute("BEGIN")
+        conn.execute("SAVEPOINT image")  # a failing image must not take the rest of the batch with it
+        try:
+            if store_ocr:
+                ocr_cache.store(sha, None, result)
+            res = service.process_receipt(user_id, args.account, path, result, receipt_date=_receipt_date(path))
+            batch_repo.mark_ingested(sha, res.session_id, str(path))
+        except Exception as e:
+            conn.execute("ROLLBACK TO image")
+            conn.execute("RELEASE image")
+            print(f"\n{path}: {e!r}", file=sys.stderr)
+            return False
+        conn.execute("RELEASE image")
+        pending_in_batch += 1
+        if pending_in_batch >= args.batch:
+            conn.commit()
+            pending_in_batch = 0
+        return True
+
+    preprocess = None if args.no_preprocess else PreprocessConfig()
+    try:
+        for path, sha, result in cached:
+            progress.tick(ingest(path, sha, result, store_ocr=False))
+        for path, sha, result, err in ocr_results(todo, args.workers, preprocess):
+            if err is not None:
+                print(f"\n{path}: {err!r}", file=sys.stderr)
+                progress.tick(False)
+                continue
+            progress.tick(ingest(path, sha, result, store_ocr=True))
+    finally:
+        conn.commit()
+        print(file=sys.stderr)
+
+    if args.out:
+        args.out.parent.mkdir(parents=True, exist_ok=True)
+        with open(args.out, "wb") as f:
+            rows = service.write_user_tsv(user_id, f)
+        print(f"{rows} rows written to {args.out}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,19 @@
+import time
 from pathlib import Path
 from src.db.db import connect, init_db
+from src.db.migrations import schema_version
 
 
 def main():
     db_path = Path("./data/app.db")
+    t0 = time.perf_counter()
     conn = connect(db_path)
-    schema_sql = Path("./src/db/schema.sql").read_text(encoding="utf-8")
-    init_db(conn, schema_sql)
-    print("DB initialized at", db_path)
+    applied = init_db(conn)
+    elapsed_ms = (time.perf_counter() - t0) * 1000
+    if applied:
+        print(f"DB at {db_path} migrated to version {schema_version(conn)} ({', '.join(m.name for m in applied)}) in {elapsed_ms:.0f} ms")
+    else:
+        print(f"DB at {db_path} is current (version {schema_version(conn)}), checked in {elapsed_ms:.1f} ms")
 
 
 if __name__ == "__main__":
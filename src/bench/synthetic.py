@@ -0,0 +1,115 @@
+import io
+import random
+from typing import Optional
+
+from src.ocr.ocr_result import OCRLine, OCRResult
+
+_BRANDS = ["GV", "MM", "GREAT VALUE", "MEMBERS MARK", "LALA", "BIMBO", "NESTLE", "KIRKLAND", "HERDEZ", "JUMEX"]
+_ITEMS = [
+    "MILK 2PCT", "WHOLE MILK", "EGGS 18CT", "WHITE BREAD", "BANANAS", "AVOCADO", "TORTILLAS", "RICE 1KG",
+    "BLACK BEANS", "CHICKEN BREAST", "GROUND BEEF", "YOGURT", "CHEDDAR", "COFFEE", "ORANGE JUICE", "PAPER TOWEL",
+    "TOILET PAPER", "DETERGENT", "SHAMPOO", "TOOTHPASTE", "APPLES", "TOMATO", "ONION", "CEREAL", "PASTA",
+]
+_SIZES = ["", "1L", "2L", "500G", "1KG", "12PK", "6CT", "24OZ"]
+
+
+def item_names(n: int, seed: int = 0) -> list[str]:
+    """
+    n distinct receipt-style item names.
+    """
+    rng = random.Random(seed)
+    names: set[str] = set()
+    while len(names) < n:
+        parts = [rng.choice(_BRANDS), rng.choice(_ITEMS), rng.choice(_SIZES)]
+        if len(names) >= len(_BRANDS) * len(_ITEMS) * len(_SIZES) // 2:
+            parts.append(str(rng.randint(1, 10**6)))  # keep generating unique names past the vocabulary
+        names.add(" ".join(p for p in parts if p))
+    return sorted(names)
+
+
+def _noisy(name: str, rng: random.Random, rate: float) -> str:
+    """
+    Drop a vowel now and then, like OCR does ("MILK" -> "MLK").
+    """
+    if rng.random() >= rate:
+        return name
+    vowels = [i for i, ch in enumerate(name) if ch in "AEIOU"]
+    if not vowels:
+        return name
+    i = rng.choice(vowels)
+    return name[:i] + name[i + 1:]
+
+
+def receipt(store: str, n_lines: int, names: list[str], seed: int = 0, noise: float = 0.05) -> OCRResult:
+    """
+    Synthetic OCR output for a WALMART or SAMS receipt with n_lines items plus header/footer lines.
+    """
+    rng = random.Random(seed)
+    lines: list[OCRLine] = []
+    y = 0
+
+    def add(text: str) -> None:
+        nonlocal y
+        conf = [round(rng.uniform(0.75, 0.99), 2) for _ in text.split()]
+        lines.append(OCRLine(text, (10, y, 10 + 12 * len(text), y + 20), conf))
+        y += 24
+
+    if store == "WALMART":
+        add("Walmart")
+        add("Save money. Live better.")
+    else:
+        add("SAM'S CLUB")
+        add("MEMBERSHIP WAREHOUSE")
+    add(f"ST# {rng.randint(1000, 9999)} OP# {rng.randint(10, 99)} TE# {rng.randint(1, 20)}")
+
+    total = 0.0
+    for _ in range(n_lines):
+        name = _noisy(rng.choice(names), rng, noise)
+        price = round(rng.uniform(0.5, 250.0), 2)
+        total += price
+        upc = f"{rng.randint(10**11, 10**12 - 1)}"
+        if store == "WALMART":
+            add(f"{name} {upc} {price:.2f} N")
+        else:
+            add(f"E {upc[:7]} {name} {price:.2f} N")
+
+    add(f"SUBTOTAL {total:.2f}")
+    add(f"TAX {total * 0.16:.2f}")
+    add(f"TOTAL {total * 1.16:.2f}")
+    add("THANK YOU")
+    return OCRResult(lines)
+
+
+def receipt_image(ocr: OCRResult, width: int = 1200, seed: int = 0) -> bytes:
+    """
+    Render a receipt as a JPEG photo-like fixture (paper on a dark background, slightly rotated). Needs Pillow.
+    """
+    from PIL import Image, ImageDraw
+
+    rng = random.Random(seed)
+    line_h = 28
+    paper = Image.new("L", (width, line_h * (len(ocr) + 4)), 245)
+    draw = ImageDraw.Draw(paper)
+    for i, line in enumerate(ocr.lines):
+        draw.text((40, line_h * (i + 2)), line.text, fill=0)
+
+    photo = Image.new("L", (int(paper.width * 1.3), int(paper.height * 1.15)), 60)
+    photo.paste(paper, ((photo.width - paper.width) // 2, (photo.height - paper.height) // 2))
+    photo = photo.rotate(rng.uniform(-4, 4), fillcolor=60, expand=False).convert("RGB")
+
+    buf = io.BytesIO()
+    photo.save(buf, format="JPEG", quality=85)
+    return buf.getvalue()
+
+
+def mapping_rows(names: list[str], seed: int = 0, limit: Optional[int] = None) -> list[tuple[str, str, str, str]]:
+    """
+    (raw_name, canonical_name, category, subcategory) rows to seed item_mappings.
+    """
+    rng = random.Random(seed)
+    cats = [("Groceries", "Dairy"), ("Groceries", "Produce"), ("Groceries", "Meat"), ("Household", "Cleaning"), ("Personal", "Care")]
+    rows = []
+    for name in names[:limit]:
+        cat, sub = rng.choice(cats)
+        rows.append((name, name.title(), cat, sub))
+    return rows
@@ -1,16 +1,21 @@
 from __future__ import annotations
+import io
+import sqlite3
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Optional
+from typing import BinaryIO, Iterable, Iterator, Optional
 
-from src.db.repo import Repo
+from src.db.repo import Repo, Resolution
+from src.mapping.cache import MappingCache
+from src.mapping.fuzzy import FuzzyIndex, Suggestion
+from src.mapping.mapper import map_keys
+from src.mapping.normalize import normalize_item_name
 from src.ocr.ocr_engine import OCREngine
+from src.ocr.ocr_result import OCRResult
 from src.parsing.detect_store import detect_store
-from src.parsing.walmart_parser import parse_walmart
-from src.parsing.sams_parser import parse_sams
-from src.mapping.normalize import normalize_item_name
-from src.mapping.mapper import map_or_mark_unknown
-from src.export.money_manager_tsv import TSVRow, to_tsv, today_mmddyyyy
+from src.parsing.registry import registry
+from src.metrics import metrics
+from src.export.money_manager_tsv import TSVRow, today_mmddyyyy, write_tsv
 
 
 @dataclass
@@ -19,101 +24,181 @@ class ProcessResult:
     unknown_count: int
 
 
+@dataclass
+class ExportResult:
+    """
+    What an incremental export contained; the watermark to record once the file was delivered.
+    """
+    rows: int = 0
+    change_seq: int = 0
+    max_line_id: int = 0
+    max_session_id: int = 0
+
+
 class ReceiptService:
-    def __init__(self, repo: Repo, ocr: OCREngine, downloads_dir: Path):
+    def __init__(
+        self,
+        repo: Repo,
+        ocr: Optional[OCREngine],
+        downloads_dir: Path,
+        mappings: Optional[MappingCache] = None,
+        fuzzy: Optional[FuzzyIndex] = None,
+        auto_apply_threshold: float = 0.0,
+    ):
         self.repo = repo
         self.ocr = ocr
         self.downloads_dir = downloads_dir
-
-    def process_receipt(self, user_id: int, account: str, image_path: Path) -> ProcessResult:
-        receipt_date = today_mmddyyyy()
-        session_id = self.repo.create_session(user_id=user_id, account=account, receipt_date=receipt_date, image_path=str(image_path))
+        self.mappings = mappings or MappingCache(repo)
+        self.fuzzy = fuzzy or FuzzyIndex(self.mappings)
+        self.auto_apply_threshold = auto_apply_threshold
+
+    def process_receipt(
+        self,
+        user_id: int,
+        account: str,
+        image_path: Optional[Path],
+        ocr_result: Optional[OCRResult] = None,
+        receipt_date: Optional[str] = None,
+        session_id: Optional[int] = None,
+    ) -> ProcessResult:
+        """
+        Run the full pipeline for one image. Pass ocr_result when OCR already ran elsewhere (worker process, cache),
+        receipt_date (mm/dd/yyyy) when the receipt is not from today, and session_id to fill an existing session
+        (durable jobs create theirs up front; re-running is safe).
+        """
+        if session_id is None:
+            receipt_date = receipt_date or today_mmddyyyy()
+            session_id = self.repo.create_session(user_id=user_id, account=account, receipt_date=receipt_date, image_path=str(image_path) if image_path else None)
 
         # OCR
-        ocr_text = self.ocr.extract_text(image_path)
-
-        # Store detect
-        store = detect_store(ocr_text)
-        if store:
-            self.repo.set_session_store(session_id, store)
-
-        # Parse
-        if store == "WALMART":
-            parsed_lines = parse_walmart(ocr_text)
-        elif store == "SAMS":
-            parsed_lines = parse_sams(ocr_text)
-        else:
+        if ocr_result is None:
+            with metrics.span("ocr"):
+                if self.ocr is None:
+                    # created on first use: most receipts arrive with OCR already done by the worker pool
+                    self.ocr = OCREngine()
+                ocr_result = self.ocr.extract(image_path)
+
+        # Store detect + parse
+        with metrics.span("detect"):
+            store = detect_store(ocr_result)
+        parser = registry.get(store)
+        if parser is None:
             # Placeholder: ask user store via Telegram (implement in bot layer)
-            parsed_lines = []
             self.repo.set_session_status(session_id, "AWAITING_USER")
             return ProcessResult(session_id=session_id, unknown_count=0)
 
-        # Persist lines + mapping
-        for pl in parsed_lines:
-            nk = normalize_item_name(pl.raw_name)
-            line_id = self.repo.add_line(session_id, pl.raw_name, nk, float(pl.amount), float(pl.confidence))
-            mapping_id = map_or_mark_unknown(self.repo, user_id, nk)
-            if mapping_id:
-                self.repo.set_line_mapping(line_id, mapping_id)
+        self.repo.set_session_store(session_id, store)
+        with metrics.span("parse"):
+            parsed_lines = parser.parse(ocr_result)
 
-        unknown = self.repo.unresolved_lines(session_id)
-        if unknown:
-            self.repo.set_session_status(session_id, "AWAITING_USER")
-        else:
-            self.repo.set_session_status(session_id, "DONE")
+        # Map on this thread: a cold cache load or fuzzy index build must not run inside the
+        # writer's transaction, where it would hold up every other write
+        with metrics.span("map"):
+            keys = [normalize_item_name(pl.raw_name) for pl in parsed_lines]
+            mapping_ids = map_keys(self.mappings, user_id, keys, self.fuzzy, self.auto_apply_threshold)
 
-        return ProcessResult(session_id=session_id, unknown_count=len(unknown))
+        # Persist lines + mapping (single transaction, also sets the session status)
+        with metrics.span("persist"):
+            unknown_count = self.repo.ingest_lines(session_id, user_id, parsed_lines, mapping_ids=mapping_ids)
+        return ProcessResult(session_id=session_id, unknown_count=unknown_count)
 
     def export_tsv(self, user_id: int, session_id: int) -> str:
-        session = self.repo.get_session(session_id)
-        account = session["account"]
-        date = session["receipt_date"]
-
-        lines = self.repo.list_lines(session_id)
-        rows: list[TSVRow] = []
-
-        for line in lines:
-            if line["mapping_id"] is None:
-                # you can either skip or raise; for now raise
-                raise ValueError("Cannot export: unresolved lines exist")
-
-            mapping = self.repo.conn.execute(
-                "SELECT category, subcategory, canonical_name FROM item_mappings WHERE id=?",
-                (line["mapping_id"],),
-            ).fetchone()
-
-            rows.append(
-                TSVRow(
-                    date=date,
-                    account=account,
-                    category=mapping["category"],
-                    subcategory=mapping["subcategory"],
-                    note=line["raw_name"],         # NOTE = item name (your corrected rule)
-                    amount=float(line["amount"]),
-                )
-            )
-
-        return to_tsv(rows)
+        buf = io.BytesIO()
+        self.write_session_tsv(user_id, session_id, buf)
+        return buf.getvalue().decode("utf-8")
+
+    def write_session_tsv(self, user_id: int, session_id: int, out: BinaryIO, compress: bool = False) -> int:
+        """
+        Stream one session's TSV into `out`. Returns the number of rows written.
+        """
+        if self.repo.has_unresolved_lines(session_id):
+            # you can either skip or raise; for now raise
+            raise ValueError("Cannot export: unresolved lines exist")
+        with metrics.span("export"):
+            return write_tsv(_tsv_rows(self.repo.iter_export_rows(user_id, session_id=session_id)), out, compress)
+
+    def write_range_tsv(self, user_id: int, date_from: str, date_to: str, out: BinaryIO, compress: bool = False) -> int:
+        """
+        Stream every DONE session with receipt_date in [date_from, date_to] (yyyy-mm-dd, inclusive).
+        """
+        rows = self.repo.iter_export_rows(user_id, date_from=date_from, date_to=date_to, status="DONE")
+        return write_tsv(_tsv_rows(rows), out, compress)
+
+    def write_user_tsv(self, user_id: int, out: BinaryIO, compress: bool = False) -> int:
+        """
+        Stream every resolved line of every session of the user; unresolved lines are skipped.
+        """
+        return write_tsv(_tsv_rows(self.repo.iter_export_rows(user_id)), out, compress)
+
+    def write_new_tsv(self, user_id: int, out: BinaryIO, compress: bool = False) -> ExportResult:
+        """
+        Stream the resolved lines created or remapped since the user's last recorded export
+        (everything on the first one). The watermark only moves with record_export(), so a file
+        that never reached the user is produced again next time.
+        """
+        last = self.repo.last_export(user_id)
+        result = ExportResult(
+            change_seq=last["change_seq"] if last else 0,
+            max_line_id=last["max_line_id"] if last else 0,
+            max_session_id=last["max_session_id"] if last else 0,
+        )
+        rows = self.repo.iter_export_rows(user_id, since_seq=result.change_seq)
+        with metrics.span("export"):
+            result.rows = write_tsv(_tsv_rows(_track_watermark(rows, result)), out, compress)
+        return result
+
+    def record_export(self, user_id: int, result: ExportResult) -> None:
+        """
+        Advance the user's watermark past an incremental export that was delivered.
+        """
+        if result.rows:
+            self.repo.log_export(user_id, result.change_seq, result.max_line_id, result.max_session_id, result.rows)
+
+    def suggest_for_unknowns(self, user_id: int, session_id: int, k: int = 3, min_score: float = 0.5) -> list[tuple[sqlite3.Row, list[Suggestion]]]:
+        """
+        Unresolved lines of the session, each with its closest known mappings.
+        """
+        return [
+            (line, self.fuzzy.suggest(user_id, line["normalized_key"], k=k, min_score=min_score))
+            for line in self.repo.unresolved_lines(session_id)
+        ]
+
+    def resolve_unknowns(self, user_id: int, resolutions: Iterable[Resolution]) -> dict[int, int]:
+        """
+        Save mappings for many unknown lines at once; each also resolves the same item in the user's other open sessions.
+        Returns {session_id: unresolved lines left} for every session that changed (0 = DONE).
+        """
+        mapping_ids, remaining = self.repo.resolve_lines(user_id, resolutions)
+        self.mappings.add_mappings(user_id, mapping_ids)
+        return remaining
 
     def resolve_one_unknown(self, user_id: int, session_id: int, line_id: int, category: str, subcategory: str, canonical_name: Optional[str] = None) -> None:
         """
         Save mapping for this line's normalized key, then attach mapping to line.
         """
-        line = self.repo.conn.execute("SELECT * FROM receipt_lines WHERE id=?", (line_id,)).fetchone()
-        if not line:
+        line = self.repo.get_line(line_id)
+        if not line or line["session_id"] != session_id:
             raise ValueError("line not found")
-
-        nk = line["normalized_key"]
-        raw_name = line["raw_name"]
-        mapping_id = self.repo.upsert_mapping(
-            user_id=user_id,
-            normalized_key=nk,
-            canonical_name=canonical_name or raw_name,
-            category=category,
-            subcategory=subcategory,
+        self.resolve_unknowns(user_id, [Resolution(line_id, category, subcategory, canonical_name)])
+
+
+def _track_watermark(rows: Iterable[sqlite3.Row], result: ExportResult) -> Iterator[sqlite3.Row]:
+    # The rows come from one snapshot and change_seq follows commit order, so the highest one
+    # seen is a safe watermark: anything changed later gets a higher change_seq.
+    for r in rows:
+        result.change_seq = max(result.change_seq, r["change_seq"])
+        result.max_line_id = max(result.max_line_id, r["line_id"])
+        result.max_session_id = max(result.max_session_id, r["session_id"])
+        yield r
+
+
+def _tsv_rows(rows: Iterable[sqlite3.Row]) -> Iterator[TSVRow]:
+    for r in rows:
+        yield TSVRow(
+            date=r["receipt_date"],
+            account=r["account"],
+            category=r["category"],
+            subcategory=r["subcategory"],
+            note=r["raw_name"],         # NOTE = item name (your corrected rule)
+            amount=float(r["amount"]),
         )
-        self.repo.set_line_mapping(line_id, mapping_id)
-
-        # if no more unknown lines -> mark DONE
-        if not self.repo.unresolved_lines(session_id):
-            self.repo.set_session_status(session_id, "DONE")
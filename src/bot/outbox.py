@@ -0,0 +1,280 @@
+from __future__ import annotations
+import asyncio
+import contextvars
+import io
+import logging
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from datetime import timedelta
+from typing import Any, Hashable, Optional, Union
+
+from telegram import Bot, Message
+from telegram.error import BadRequest, RetryAfter
+
+from src.metrics import metrics
+
+log = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """
+    `rate` tokens per second, holding at most `burst`. Not thread-safe: used from the event loop only.
+    """
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def delay(self) -> float:
+        """
+        Seconds until a token is available (0 = now).
+        """
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self) -> None:
+        self.tokens -= 1
+
+
+@dataclass
+class OutboxStats:
+    sent: int = 0             # API calls, retries included
+    edited: int = 0
+    merged: int = 0           # progress updates folded into one still waiting to be sent
+    retry_after: int = 0      # 429 answers honored
+    failed: int = 0
+
+    @property
+    def calls(self) -> int:
+        return self.sent + self.edited
+
+
+@dataclass
+class _Outgoing:
+    chat_id: int
+    text: Optional[str] = None
+    document: Optional[bytes] = None
+    filename: Optional[str] = None
+    reply_to: Optional[int] = None
+    progress_key: Optional[Hashable] = None
+    final: bool = False
+    queued_at: float = field(default_factory=time.perf_counter)
+    future: asyncio.Future = field(default_factory=lambda: asyncio.get_running_loop().create_future())
+
+
+class Outbox:
+    """
+    Every message the bot sends goes through here, so bursts never trip Telegram's flood limits.
+
+    - Each chat has a FIFO queue drained by its own task, through a per-chat and a global token bucket.
+    - A RetryAfter (429) pauses that chat for the time Telegram asks, then the message is retried.
+    - progress() shows one message per key (e.g. a receipt job) and edits it on later calls; an update
+      made while the previous one is still queued replaces its text, so a backlog costs no extra calls.
+    - Documents are bytes and uploaded from memory; every attempt gets a fresh buffer.
+
+    The send methods return a future: await it to know the message was delivered (it raises if
+    it was not), or ignore it so the handler doesn't wait for the queue.
+    """
+
+    def __init__(
+        self,
+        bot: Bot,
+        per_s: float = 25.0,
+        chat_per_s: float = 1.0,
+        chat_burst: int = 3,
+        max_retries: int = 5,
+    ):
+        self.bot = bot
+        self.chat_per_s = chat_per_s
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self.stats = OutboxStats()
+        # paced evenly: a full bucket plus its refill would allow ~2x per_s in the first second
+        self._global = TokenBucket(per_s, 1)
+        self._chats: dict[int, TokenBucket] = {}
+        self._last_sweep = time.monotonic()
+        self._queues: dict[int, deque[_Outgoing]] = {}
+        self._tasks: dict[int, asyncio.Task] = {}
+        self._progress_ids: dict[Hashable, int] = {}          # key -> message_id shown to the user
+        self._progress_pending: dict[Hashable, _Outgoing] = {}  # key -> update not sent yet
+
+    @property
+    def depth(self) -> int:
+        return sum(len(q) for q in self._queues.values())
+
+    # ---------- sending ----------
+    def send_message(self, chat_id: int, text: str, reply_to: Optional[int] = None) -> asyncio.Future:
+        return self._enqueue(_Outgoing(chat_id, text=text, reply_to=reply_to))
+
+    def send_document(self, chat_id: int, data: bytes, filename: str, reply_to: Optional[int] = None) -> asyncio.Future:
+        return self._enqueue(_Outgoing(chat_id, document=data, filename=filename, reply_to=reply_to))
+
+    def progress(
+        self, chat_id: int, key: Hashable, text: str, reply_to: Optional[int] = None, final: bool = False
+    ) -> asyncio.Future:
+        """
+        Show `text` as the progress message for `key`: sent the first time, edited afterwards.
+        final=True ends it (the key is forgotten once delivered).
+        """
+        pending = self._progress_pending.get(key)
+        if pending is not None:
+            pending.text = text
+            pending.final = pending.final or final
+            self.stats.merged += 1
+            return pending.future
+        item = _Outgoing(chat_id, text=text, reply_to=reply_to, progress_key=key, final=final)
+        self._progress_pending[key] = item
+        return self._enqueue(item)
+
+    def end_progress(self, key: Hashable) -> None:
+        """
+        Forget the progress message for `key` without changing it; one still waiting is dropped.
+        """
+        self._progress_ids.pop(key, None)
+        pending = self._progress_pending.pop(key, None)
+        if pending is not None:
+            queue = self._queues.get(pending.chat_id)
+            if queue is not None and pending in queue:
+                queue.remove(pending)
+                self.stats.merged += 1
+                pending.future.set_result(None)
+
+    async def close(self, timeout: float = 10.0) -> None:
+        """
+        Give queued messages up to `timeout` seconds to go out, then cancel the rest.
+        """
+        tasks = list(self._tasks.values())
+        if tasks:
+            _, still_running = await asyncio.wait(tasks, timeout=timeout)
+            for task in still_running:
+                task.cancel()
+            if still_running:
+                log.warning("outbox closed with %s messages unsent", self.depth)
+
+    # ---------- dispatch ----------
+    def _enqueue(self, item: _Outgoing) -> asyncio.Future:
+        # a caller that doesn't await must not get "exception was never retrieved" (it is logged here)
+        item.future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        self._queues.setdefault(item.chat_id, deque()).append(item)
+        task = self._tasks.get(item.chat_id)
+        if task is None or task.done():
+            # a fresh context: the task outlives the caller, whose metrics trace must not collect its sends
+            self._tasks[item.chat_id] = asyncio.create_task(
+                self._drain(item.chat_id), name=f"outbox-{item.chat_id}", context=contextvars.Context()
+            )
+        return item.future
+
+    async def _drain(self, chat_id: int) -> None:
+        queue = self._queues[chat_id]
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            bucket = self._chats[chat_id] = TokenBucket(self.chat_per_s, self.chat_burst)
+        try:
+            while queue:
+                await _acquire(bucket, self._global)
+                if not queue:
+                    break   # the only message was dropped by end_progress() meanwhile
+                item = queue.popleft()
+                if item.progress_key is not None and self._progress_pending.get(item.progress_key) is item:
+                    # from here on, a new update for the key is a separate edit
+                    del self._progress_pending[item.progress_key]
+                try:
+                    await self._deliver(bucket, item)
+                except asyncio.CancelledError:
+                    item.future.cancel()
+                    raise
+        finally:
+            if self._tasks.get(chat_id) is asyncio.current_task():
+                del self._tasks[chat_id]
+            for item in queue:   # left over only when cancelled (close)
+                item.future.cancel()
+                if item.progress_key is not None and self._progress_pending.get(item.progress_key) is item:
+                    del self._progress_pending[item.progress_key]
+            del self._queues[chat_id]
+            self._sweep_buckets()
+
+    def _sweep_buckets(self) -> None:
+        # an idle chat's bucket can go once it is full again (a new one starts full);
+        # dropped earlier, a chat could get a second burst right after the first
+        now = time.monotonic()
+        if now - self._last_sweep < 60:
+            return
+        self._last_sweep = now
+        for chat_id, bucket in list(self._chats.items()):
+            if chat_id not in self._queues and bucket.delay() == 0 and bucket.tokens >= bucket.burst:
+                del self._chats[chat_id]
+
+    async def _deliver(self, bucket: TokenBucket, item: _Outgoing) -> None:
+        for attempt in range(self.max_retries + 1):
+            try:
+                with metrics.span("send"):
+                    result = await self._call(item)
+            except RetryAfter as e:
+                self.stats.retry_after += 1
+                if attempt == self.max_retries:
+                    self._fail(item, e)
+                    return
+                wait = _seconds(e.retry_after)
+                log.warning("flood limit in chat %s, retrying in %.0fs", item.chat_id, wait)
+                await asyncio.sleep(wait)
+                # the retry is another message as far as the limits go
+                await _acquire(bucket, self._global)
+            except Exception as e:
+                self._fail(item, e)
+                return
+            else:
+                metrics.observe("send_wait", time.perf_counter() - item.queued_at)
+                if item.progress_key is not None:
+                    if item.final:
+                        self._progress_ids.pop(item.progress_key, None)
+                    elif isinstance(result, Message):
+                        self._progress_ids[item.progress_key] = result.message_id
+                if not item.future.done():
+                    item.future.set_result(result)
+                return
+
+    async def _call(self, item: _Outgoing) -> Union[Message, bool]:
+        if item.document is not None:
+            self.stats.sent += 1
+            return await self.bot.send_document(
+                item.chat_id, document=io.BytesIO(item.document), filename=item.filename,
+                caption=item.text, reply_to_message_id=item.reply_to,
+            )
+        message_id = self._progress_ids.get(item.progress_key) if item.progress_key is not None else None
+        if message_id is not None:
+            try:
+                self.stats.edited += 1
+                return await self.bot.edit_message_text(item.text, chat_id=item.chat_id, message_id=message_id)
+            except BadRequest as e:
+                if "not modified" in e.message.lower():
+                    return True
+                # the message is gone (deleted, too old to edit): send the update as a new one
+                log.info("progress message %s not editable (%s), sending a new one", message_id, e.message)
+        self.stats.sent += 1
+        return await self.bot.send_message(item.chat_id, item.text, reply_to_message_id=item.reply_to)
+
+    def _fail(self, item: _Outgoing, error: BaseException) -> None:
+        self.stats.failed += 1
+        if item.progress_key is not None and item.final:
+            self._progress_ids.pop(item.progress_key, None)
+        log.error("could not send to chat %s: %s", item.chat_id, error)
+        if not item.future.done():
+            item.future.set_exception(error)
+
+
+async def _acquire(*buckets: TokenBucket) -> None:
+    # all at once: a token held while waiting for another would be spent late, bunching sends up
+    while (wait := max(b.delay() for b in buckets)) > 0:
+        await asyncio.sleep(wait)
+    for b in buckets:
+        b.take()
+
+
+def _seconds(retry_after: Union[int, float, timedelta, Any]) -> float:
+    # an int in python-telegram-bot 21, a timedelta in later versions
+    return retry_after.total_seconds() if isinstance(retry_after, timedelta) else float(retry_after)
@@ -0,0 +1,177 @@
+from __future__ import annotations
+import json
+import logging
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Optional
+
+from src.db.repo import Repo
+
+log = logging.getLogger(__name__)
+
+# no whitespace, no \u escapes: the smallest JSON for the session_state table
+_encode = json.JSONEncoder(separators=(",", ":"), ensure_ascii=False).encode
+
+_DELETED = None   # marker in the dirty map: remove the row on flush
+
+
+@dataclass
+class StateStats:
+    hits: int = 0
+    misses: int = 0
+    flushes: int = 0
+    rows_written: int = 0
+
+
+class SessionStateStore:
+    """
+    Conversation state per receipt session, cached in memory and written behind.
+
+    - get() loads a session's state from session_state once, then serves it from an LRU.
+    - update()/discard()/clear() change only the cache and mark the session dirty.
+    - Dirty sessions are written in one batch every `flush_s` seconds, or as soon as
+      `flush_batch` of them are waiting, and on close(). Dirty sessions are never evicted.
+
+    Up to `flush_s` of state can be lost on a crash; it only tracks progress through the
+    resolution flow, which the user can repeat. Safe to call from any thread.
+    """
+
+    def __init__(self, repo: Repo, max_sessions: int = 1000, flush_s: float = 2.0, flush_batch: int = 100):
+        self.repo = repo
+        self.max_sessions = max_sessions
+        self.flush_s = flush_s
+        self.flush_batch = flush_batch
+        self.stats = StateStats()
+        self._states: "OrderedDict[int, dict[str, Any]]" = OrderedDict()
+        self._dirty: dict[int, Optional[str]] = {}   # session_id -> encoded state, or _DELETED
+        self._flushing: set[int] = set()               # being written right now
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()    # one flush at a time, keeps writes in order
+        self._wake = threading.Event()
+        self._closed = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="session-state-flush", daemon=True)
+        self._thread.start()
+
+    def get(self, session_id: int) -> dict[str, Any]:
+        """
+        Copy of the session's state ({} if none).
+        """
+        state = self._load(session_id)
+        with self._lock:
+            return dict(state)
+
+    def update(self, session_id: int, **changes: Any) -> dict[str, Any]:
+        """
+        Merge `changes` into the session's state. Returns the new state.
+        """
+        state = self._load(session_id)
+        with self._lock:
+            state.update(changes)
+            self._mark_dirty(session_id, state)
+            return dict(state)
+
+    def discard(self, session_id: int, *keys: str) -> None:
+        """
+        Remove keys from the session's state.
+        """
+        state = self._load(session_id)
+        with self._lock:
+            for key in keys:
+                state.pop(key, None)
+            self._mark_dirty(session_id, state)
+
+    def clear(self, session_id: int) -> None:
+        """
+        Drop the session's state entirely (e.g. when its resolution flow is finished).
+        """
+        with self._lock:
+            # cached as empty until the delete is flushed, so get() doesn't read the old row back
+            self._states[session_id] = {}
+            self._states.move_to_end(session_id)
+            self._dirty[session_id] = _DELETED
+            self._wake_if_full()
+
+    def flush(self) -> int:
+        """
+        Write all pending changes in one transaction. Returns the number of sessions written.
+        """
+        with self._flush_lock:
+            with self._lock:
+                pending, self._dirty = self._dirty, {}
+                self._flushing = set(pending)
+            if not pending:
+                return 0
+            puts = [(sid, payload) for sid, payload in pending.items() if payload is not _DELETED]
+            deletes = [sid for sid, payload in pending.items() if payload is _DELETED]
+            try:
+                self.repo.write_states(puts, deletes)
+            except Exception:
+                with self._lock:
+                    # keep changes made since, retry the rest on the next flush
+                    for sid, payload in pending.items():
+                        self._dirty.setdefault(sid, payload)
+                raise
+            finally:
+                with self._lock:
+                    self._flushing = set()
+                    self._evict()   # written sessions may go now
+            self.stats.flushes += 1
+            self.stats.rows_written += len(pending)
+            return len(pending)
+
+    def close(self) -> None:
+        """
+        Stop the background flusher and write what is still pending.
+        """
+        self._closed.set()
+        self._wake.set()
+        self._thread.join()
+        self.flush()
+
+    def _load(self, session_id: int) -> dict[str, Any]:
+        with self._lock:
+            state = self._states.get(session_id)
+            if state is not None:
+                self.stats.hits += 1
+                self._states.move_to_end(session_id)
+                return state
+        # read outside the lock; if another thread loaded it meanwhile, its copy wins
+        loaded = self.repo.get_state(session_id)
+        with self._lock:
+            self.stats.misses += 1
+            state = self._states.setdefault(session_id, loaded)
+            self._states.move_to_end(session_id)
+            self._evict()
+            return state
+
+    def _mark_dirty(self, session_id: int, state: dict[str, Any]) -> None:
+        # encode now so the flush never sees a state another thread is changing
+        self._dirty[session_id] = _encode(state)
+        self._states[session_id] = state
+        self._states.move_to_end(session_id)
+        self._wake_if_full()
+
+    def _wake_if_full(self) -> None:
+        if len(self._dirty) >= self.flush_batch:
+            self._wake.set()
+
+    def _evict(self) -> None:
+        if len(self._states) <= self.max_sessions:
+            return
+        for sid in list(self._states):
+            if len(self._states) <= self.max_sessions:
+                break
+            # unwritten changes must stay, or the next get() would read the old row
+            if sid not in self._dirty and sid not in self._flushing:
+                del self._states[sid]
+
+    def _run(self) -> None:
+        while not self._closed.is_set():
+            self._wake.wait(self.flush_s)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception:
+                log.exception("session state flush failed")
+
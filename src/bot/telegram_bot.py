@@ -1,91 +1,483 @@
 from __future__ import annotations
+import asyncio
+import io
+import json
 import logging
+import time
+from collections import defaultdict
+from datetime import date
 from pathlib import Path
+from typing import Optional
 
-from telegram import Update
-from telegram.ext import Application, CommandHandler, MessageHandler, ContextTypes, filters
+from telegram import Bot, Message, PhotoSize, Update
+from telegram.ext import Application, BaseHandler, CallbackQueryHandler, CommandHandler, MessageHandler, ContextTypes, filters
 
-from src.db.repo import Repo
+from src.config import Config
+from src.db.async_repo import AsyncRepo, PooledRepo
+from src.db.db import Database
+from src.metrics import metrics, serve_prometheus
+from src.ocr.ocr_cache import OCRCache, image_sha256
 from src.ocr.ocr_engine import OCREngine
+from src.ocr.ocr_result import OCRResult
+from src.ocr.stitch import stitch
 from src.bot.handlers import ReceiptService
+from src.bot.outbox import Outbox
+from src.bot.session_state import SessionStateStore
+from src.mapping.cache import MappingCache
+from src.mapping.fuzzy import FuzzyIndex
+from src.export.money_manager_tsv import today_mmddyyyy
+from src.pipeline.jobs import JobRunner
+from src.pipeline.worker_pool import ReceiptWorkerPool
+from src.storage.image_store import ImageStore
 
 log = logging.getLogger(__name__)
 
 
-def build_app(token: str, repo: Repo, downloads_dir: Path) -> Application:
-    ocr = OCREngine()
-    service = ReceiptService(repo=repo, ocr=ocr, downloads_dir=downloads_dir)
+def build_app(cfg: Config, db: Database) -> Application:
+    token = cfg.telegram.bot_token
+    downloads_dir = cfg.app.downloads_dir
+    workers = cfg.workers
 
-    app = Application.builder().token(token).build()
+    repo = AsyncRepo(db)        # handlers (event loop)
+    sync_repo = PooledRepo(db)  # pipeline (worker threads)
+    mappings = MappingCache(sync_repo, max_entries=cfg.cache.mapping_max_entries)
+    fuzzy = FuzzyIndex(mappings)
+    service = ReceiptService(
+        repo=sync_repo,
+        ocr=None,   # OCR runs in the worker pool; the service creates an engine only if it needs one
+        downloads_dir=downloads_dir,
+        mappings=mappings,
+        fuzzy=fuzzy,
+        auto_apply_threshold=cfg.fuzzy.auto_apply_threshold,
+    )
+    states = SessionStateStore(
+        sync_repo,
+        max_sessions=cfg.cache.state_max_sessions,
+        flush_s=cfg.cache.state_flush_s,
+        flush_batch=cfg.cache.state_flush_batch,
+    )
+    image_store = ImageStore(sync_repo, downloads_dir / "images", cfg.storage)
+    ocr_cache = OCRCache(sync_repo, engine_version=OCREngine.VERSION, max_bytes=cfg.cache.ocr_max_mb * 1024 * 1024)
+    pool = ReceiptWorkerPool(
+        ocr_factory=OCREngine,
+        ocr_processes=workers.ocr_processes,
+        io_threads=workers.io_threads,
+        max_queue=workers.max_queue,
+    )
+
+    metrics_server = (
+        serve_prometheus(cfg.metrics.prometheus_port, cfg.metrics.prometheus_host)
+        if cfg.metrics.prometheus_port else None
+    )
+
+    async def _maintenance_loop() -> None:
+        while True:
+            try:
+                pruned = await pool.run_io(image_store.prune)
+                free_pages = await pool.run_io(db.maintain, cfg.storage.vacuum_pages)
+                log.info("maintenance: %s images pruned, %s free db pages released", pruned.files, free_pages)
+            except Exception:
+                log.exception("maintenance failed")
+            await asyncio.sleep(cfg.storage.maintenance_interval_h * 3600)
+
+    background: list[asyncio.Task] = []
+
+    async def _start_jobs(_: Application) -> None:
+        # picks up jobs left unfinished by the previous run as well
+        await runner.start()
+        if cfg.storage.maintenance_interval_h > 0:
+            background.append(asyncio.create_task(_maintenance_loop(), name="maintenance"))
+
+    async def _stop_jobs(_: Application) -> None:
+        # post_stop: the bot can still send, so finishing jobs and queued messages get delivered
+        for task in background:
+            task.cancel()
+        await runner.stop()
+        await outbox.close()
+
+    async def _shutdown_pool(_: Application) -> None:
+        pool.shutdown()
+        states.close()
+        if metrics_server is not None:
+            metrics_server.shutdown()
+
+    # concurrent_updates: a slow receipt must not hold back other users' updates
+    builder = (
+        Application.builder()
+        .token(token)
+        .concurrent_updates(True)
+        .post_init(_start_jobs)
+        .post_stop(_stop_jobs)
+        .post_shutdown(_shutdown_pool)
+    )
+    if cfg.telegram.api_base_url:
+        base = cfg.telegram.api_base_url.rstrip("/")
+        builder = builder.base_url(f"{base}/bot").base_file_url(f"{base}/file/bot")
+    app = builder.build()
+    outbox = Outbox(
+        app.bot,
+        per_s=cfg.telegram.send_per_s,
+        chat_per_s=cfg.telegram.send_chat_per_s,
+        chat_burst=cfg.telegram.send_chat_burst,
+        max_retries=cfg.telegram.send_max_retries,
+    )
 
     # --- Commands ---
     async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-        await update.message.reply_text(
+        outbox.send_message(
+            update.effective_chat.id,
             "Send me a receipt photo. Optional: /setaccount <name>. I will return a Money Manager .tsv."
         )
 
     async def setaccount(update: Update, context: ContextTypes.DEFAULT_TYPE):
         if not context.args:
-            await update.message.reply_text("Usage: /setaccount Cash")
+            outbox.send_message(update.effective_chat.id, "Usage: /setaccount Cash")
             return
         account = " ".join(context.args).strip()
-        user_id = repo.get_or_create_user(str(update.effective_user.id), default_account=None)
-        repo.set_default_account(user_id, account)
-        await update.message.reply_text(f"Default account set to: {account}")
+        user_id = await repo.get_or_create_user(str(update.effective_user.id), default_account=None)
+        await repo.set_default_account(user_id, account)
+        outbox.send_message(update.effective_chat.id, f"Default account set to: {account}")
 
     async def export(update: Update, context: ContextTypes.DEFAULT_TYPE):
-        # Export last session stored in conversation (placeholder)
-        await update.message.reply_text("TODO: implement /export <session_id> or export last session.")
+        """
+        /export                        -> every resolved line of every session
+        /export new                    -> only what was added or remapped since the last /export new
+        /export <session_id>           -> one session
+        /export <yyyy-mm-dd> <yyyy-mm-dd> -> DONE sessions in the date range
+        A trailing "gz" sends any of them gzipped.
+        """
+        user_id = await repo.get_or_create_user(str(update.effective_user.id), default_account=None)
+        args = context.args or []
+        compress = args[-1:] == ["gz"]
+        if compress:
+            args = args[:-1]
+        if args == ["new"]:
+            # one at a time per user, or a second one would start from the same watermark
+            async with export_locks[user_id]:
+                await export_new(update.effective_chat.id, user_id, compress)
+            return
+
+        buf = io.BytesIO()
+        try:
+            if not args:
+                filename = "money_manager_all.tsv"
+                count = await pool.run_io(service.write_user_tsv, user_id, buf, compress)
+            elif len(args) == 1 and args[0].isdigit():
+                session_id = int(args[0])
+                if (await repo.get_session(session_id))["user_id"] != user_id:
+                    raise ValueError(f"session not found: {session_id}")
+                filename = f"money_manager_{session_id}.tsv"
+                count = await pool.run_io(service.write_session_tsv, user_id, session_id, buf, compress)
+            elif len(args) == 2:
+                date_from, date_to = (date.fromisoformat(a).isoformat() for a in args)
+                filename = f"money_manager_{date_from}_{date_to}.tsv"
+                count = await pool.run_io(service.write_range_tsv, user_id, date_from, date_to, buf, compress)
+            else:
+                outbox.send_message(update.effective_chat.id, "Usage: /export [new | session_id | yyyy-mm-dd yyyy-mm-dd] [gz]")
+                return
+        except ValueError as e:
+            outbox.send_message(update.effective_chat.id, f"Error: {e}")
+            return
+
+        if count == 0:
+            outbox.send_message(update.effective_chat.id, "Nothing to export.")
+            return
+        outbox.send_document(update.effective_chat.id, buf.getvalue(), filename + ".gz" if compress else filename)
+
+    export_locks: defaultdict[int, asyncio.Lock] = defaultdict(asyncio.Lock)
+
+    async def export_new(chat_id: int, user_id: int, compress: bool) -> None:
+        buf = io.BytesIO()
+        result = await pool.run_io(service.write_new_tsv, user_id, buf, compress)
+        if result.rows == 0:
+            outbox.send_message(chat_id, "Nothing new since the last export.")
+            return
+        filename = f"money_manager_new_{date.today().isoformat()}.tsv"
+        await outbox.send_document(chat_id, buf.getvalue(), filename + ".gz" if compress else filename)
+        # only once it was delivered; a failed send leaves the rows for the next /export new
+        await pool.run_io(service.record_export, user_id, result)
+
+    async def queue(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        st = pool.stats
+        outbox.send_message(
+            update.effective_chat.id,
+            f"Queue: {st.queued} waiting, {st.running} running (max {pool.max_queue}).\n"
+            f"Done: {st.completed} ok, {st.failed} failed, {st.rejected} rejected.\n"
+            f"Latency: avg {st.avg_latency_s:.1f}s, max {st.max_latency_s:.1f}s.\n"
+            f"Mapping cache: {mappings.stats.hit_rate:.0%} hits, {mappings.stats.evictions} evictions.\n"
+            f"OCR cache: {ocr_cache.stats.hit_rate:.0%} hits "
+            f"({ocr_cache.stats.file_id_hits} by file id, {ocr_cache.stats.hash_hits} by hash), "
+            f"{ocr_cache.stats.evicted} evicted.\n"
+            f"Outbox: {outbox.depth} waiting, {outbox.stats.calls} calls "
+            f"({outbox.stats.edited} edits, {outbox.stats.merged} merged), {outbox.stats.retry_after} flood waits."
+        )
+
+    async def stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        summary = metrics.summary()
+        if not summary:
+            outbox.send_message(update.effective_chat.id, "No receipts processed yet.")
+            return
+        lines = ["stage: p50 / p95 (count)"]
+        for stage, s in summary.items():
+            lines.append(f"{stage}: {_fmt_seconds(s['p50'])} / {_fmt_seconds(s['p95'])} ({s['count']})")
+        outbox.send_message(update.effective_chat.id, "\n".join(lines))
+
+    async def report(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """
+        /report [yyyy-mm] -> spending per category for the month (default: this month)
+        """
+        args = context.args or []
+        month = args[0] if args else date.today().strftime("%Y-%m")
+        try:
+            month = date.fromisoformat(f"{month}-01").strftime("%Y-%m")
+        except ValueError:
+            outbox.send_message(update.effective_chat.id, "Usage: /report [yyyy-mm]")
+            return
+        user_id = await repo.get_or_create_user(str(update.effective_user.id), default_account=None)
+        rows = await repo.spending_summary(user_id, month)
+        if not rows:
+            outbox.send_message(update.effective_chat.id, f"No spending recorded for {month}.")
+            return
+        total = sum(r["total"] for r in rows)
+        lines = [f"Spending {month}: {total:.2f}"]
+        for r in rows:
+            lines.append(f"{r['category']} / {r['subcategory']}: {r['total']:.2f} ({r['line_count']} items)")
+        outbox.send_message(update.effective_chat.id, "\n".join(lines))
 
     app.add_handler(CommandHandler("start", start))
     app.add_handler(CommandHandler("setaccount", setaccount))
     app.add_handler(CommandHandler("export", export))
+    app.add_handler(CommandHandler("queue", queue))
+    app.add_handler(CommandHandler("stats", stats))
+    app.add_handler(CommandHandler("report", report))
 
     # --- Photo handler ---
-    async def on_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
-        tg_user_id = str(update.effective_user.id)
-        user_id = repo.get_or_create_user(tg_user_id, default_account=None)
+    async def ocr_photo(bot: Bot, file_id: str, file_unique_id: str) -> tuple[OCRResult, Optional[Path]]:
+        """
+        OCR one photo, going through the cache. Returns the result and the saved image path (if saved).
+        """
+        # Same Telegram file seen before -> skip download and OCR
+        with metrics.span("ocr_cache"):
+            ocr_result = await pool.run_io(ocr_cache.lookup_file, file_unique_id)
+        if ocr_result is not None:
+            return ocr_result, None
+
+        with metrics.span("download"):
+            file = await bot.get_file(file_id)
+            data = bytes(await file.download_as_bytearray())
+        sha = await pool.run_io(image_sha256, data)
+        image_path = await pool.run_io(image_store.put, data, sha) if cfg.app.save_images else None
+        ocr_result = await pool.run_io(ocr_cache.lookup_image, sha, file_unique_id)
+        if ocr_result is None:
+            ocr_result = (await pool.run_ocr(data, cfg.preprocess)).result
+            await pool.run_io(ocr_cache.store, sha, file_unique_id, ocr_result)
+        return ocr_result, image_path
+
+    async def run_job(job) -> None:
+        """
+        Run one durable receipt job from its last checkpoint: QUEUED -> OCR_DONE -> MAPPED -> DONE.
+        Detection, parsing and mapping are one transaction (ingest_lines), so they share the MAPPED checkpoint.
+        """
+        payload = json.loads(job["payload_json"])
+        session_id = job["session_id"]
+        user_id = job["user_id"]
+        lease_s = runner.lease_s
+        bot = app.bot
+        progress_key = ("job", job["id"])
+
+        with metrics.trace() as tr:
+            with metrics.span("total"):
+                if job["stage"] == "QUEUED":
+                    # album parts are OCR'd concurrently (the OCR pool runs them in parallel)
+                    parts = await asyncio.gather(*(ocr_photo(bot, p["file_id"], p["file_unique_id"]) for p in payload["photos"]))
+                    ocr_result = parts[0][0] if len(parts) == 1 else stitch([r for r, _ in parts])
+                    image_path = parts[0][1] if len(parts) == 1 else None
+                    stored = [path for _, path in parts if path is not None]
+                    await repo.checkpoint_job(job["id"], "OCR_DONE", lease_s, ocr_result.to_bytes())
+                    stage = "OCR_DONE"
+                else:
+                    ocr_result = OCRResult.from_bytes(job["ocr_result"]) if job["ocr_result"] else None
+                    image_path = None
+                    stored = []
+                    stage = job["stage"]
+
+                if stage == "OCR_DONE":
+                    result = await pool.run_io(
+                        service.process_receipt, user_id, payload["account"], image_path, ocr_result, None, session_id
+                    )
+                    await repo.checkpoint_job(job["id"], "MAPPED", lease_s)
+                    unknown_count = result.unknown_count
+                else:
+                    unknown_count = await repo.count_unresolved(session_id)
+
+                with metrics.span("reply"):
+                    if unknown_count > 0:
+                        suggestions = await pool.run_io(
+                            service.suggest_for_unknowns, user_id, session_id, cfg.fuzzy.top_k, cfg.fuzzy.min_score
+                        )
+                        # replaces the "Processing..." message rather than adding one
+                        await outbox.progress(
+                            job["chat_id"],
+                            progress_key,
+                            f"Processed. I found {unknown_count} unknown items.\n"
+                            f"{_format_suggestions(suggestions)}"
+                            f"TODO: implement interactive resolution flow for session {session_id}.",
+                            reply_to=job["message_id"],
+                            final=True,
+                        )
+                    else:
+                        # Export and send TSV immediately, straight from memory
+                        buf = io.BytesIO()
+                        await pool.run_io(service.write_session_tsv, user_id, session_id, buf)
+                        # a "Processing..." message that hasn't gone out yet is not worth sending anymore
+                        outbox.end_progress(progress_key)
+                        await outbox.send_document(
+                            job["chat_id"], buf.getvalue(), f"money_manager_{session_id}.tsv", reply_to=job["message_id"]
+                        )
+        await repo.complete_job(job["id"])
+        # The job is DONE: housekeeping below must not raise into the runner, which would count
+        # a failed attempt (and maybe tell the user) for a receipt that was delivered.
+        for path in stored:
+            # OCR is done with the photos: keep them in the smaller archive format
+            try:
+                await pool.run_io(image_store.archive, path.name)
+            except Exception:
+                log.exception("archiving %s failed (kept as is)", path)
+        if cfg.metrics.persist_timings:
+            try:
+                await repo.add_timings(session_id, tr.stages)
+            except Exception:
+                log.exception("storing timings of session %s failed", session_id)
+
+    async def job_failed(job, error: BaseException) -> None:
+        if isinstance(error, NotImplementedError):
+            text = f"Not implemented yet: {error}"
+        else:
+            text = f"Error: {error}"
+        await outbox.progress(job["chat_id"], ("job", job["id"]), text, reply_to=job["message_id"], final=True)
 
-        default_account = repo.get_default_account(user_id) or "Cash"
+    runner = JobRunner(
+        repo,
+        pool,
+        run_job,
+        on_failure=job_failed,
+        lease_s=cfg.jobs.lease_s,
+        max_attempts=cfg.jobs.max_attempts,
+        backoff_base_s=cfg.jobs.backoff_base_s,
+        poll_s=cfg.jobs.poll_s,
+    )
+
+    async def handle_receipt(message: Message, photos: list[PhotoSize], caption: str):
+        """
+        One receipt = one session + one durable job, whether it arrived as a single photo or an album of parts.
+        """
+        user_id = await repo.get_or_create_user(str(message.from_user.id), default_account=None)
+        default_account = (await repo.get_default_account(user_id)) or "Cash"
         # Optional: allow account override in caption like: "account=Debit"
-        caption = (update.message.caption or "").strip()
         account = _parse_account_from_caption(caption) or default_account
 
-        # Download highest resolution photo
-        photo = update.message.photo[-1]
-        file = await context.bot.get_file(photo.file_id)
+        payload = {
+            "account": account,
+            "photos": [{"file_id": p.file_id, "file_unique_id": p.file_unique_id} for p in photos],
+        }
+        job_id, _ = await repo.create_job(user_id, account, today_mmddyyyy(), message.chat_id, message.message_id, payload)
 
-        downloads_dir.mkdir(parents=True, exist_ok=True)
-        local_path = downloads_dir / f"receipt_{photo.file_id}.jpg"
-        await file.download_to_drive(custom_path=str(local_path))
+        # queued before the job can run, so its result edits this message instead of racing it
+        if len(photos) == 1:
+            outbox.progress(message.chat_id, ("job", job_id), "Got it. Processing receipt...", reply_to=message.message_id)
+        else:
+            outbox.progress(
+                message.chat_id, ("job", job_id), f"Got {len(photos)} photos. Processing them as one receipt...",
+                reply_to=message.message_id,
+            )
+        runner.enqueued()
 
-        await update.message.reply_text("Got it. Processing receipt...")
+    # media_group_id -> messages of an album still arriving
+    albums: dict[str, list[Message]] = {}
+    # media_group_id -> when the album was turned away (its later parts are dropped without another notice)
+    rejected_albums: dict[str, float] = {}
 
-        try:
-            result = service.process_receipt(user_id=user_id, account=account, image_path=local_path)
+    async def on_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        message = update.message
+        group_id = message.media_group_id
 
-            if result.unknown_count > 0:
-                await update.message.reply_text(
-                    f"Processed. I found {result.unknown_count} unknown items.\n"
-                    f"TODO: implement interactive resolution flow for session {result.session_id}."
-                )
-            else:
-                # Export and send TSV immediately
-                tsv = service.export_tsv(user_id=user_id, session_id=result.session_id)
-                out_path = downloads_dir / f"money_manager_{result.session_id}.tsv"
-                out_path.write_text(tsv, encoding="utf-8")
-                await update.message.reply_document(document=open(out_path, "rb"), filename=out_path.name)
-        except NotImplementedError as e:
-            await update.message.reply_text(f"Not implemented yet: {e}")
-        except Exception as e:
-            log.exception("processing failed")
-            await update.message.reply_text(f"Error: {e}")
+        # parts of an album that was already accepted (or refused) follow its first part
+        if group_id is not None:
+            group = albums.get(group_id)
+            if group is not None:
+                group.append(message)
+                return
+            if group_id in rejected_albums:
+                return
+
+        # Backpressure: don't accept more receipts than the queue limit
+        if runner.backlog >= pool.max_queue:
+            outbox.send_message(message.chat_id, "Queue full, please try again in a minute.")
+            if group_id is not None:
+                now = time.monotonic()
+                for gid, at in list(rejected_albums.items()):
+                    if now - at > 60 + workers.album_window_s:
+                        del rejected_albums[gid]
+                rejected_albums[group_id] = now
+            return
+
+        if group_id is None:
+            await handle_receipt(message, [message.photo[-1]], (message.caption or "").strip())
+            return
+
+        # Telegram delivers an album as separate updates; the first one waits for the rest
+        albums[group_id] = [message]
+        await asyncio.sleep(workers.album_window_s)
+        messages = sorted(albums.pop(group_id), key=lambda m: m.message_id)
+
+        caption = next(((m.caption or "").strip() for m in messages if m.caption), "")
+        await handle_receipt(messages[0], [m.photo[-1] for m in messages], caption)
 
     app.add_handler(MessageHandler(filters.PHOTO, on_photo))
 
     return app
 
 
+# update type each handler class consumes
+_HANDLER_UPDATES: dict[type[BaseHandler], str] = {
+    CommandHandler: Update.MESSAGE,
+    MessageHandler: Update.MESSAGE,
+    CallbackQueryHandler: Update.CALLBACK_QUERY,
+}
+
+
+def allowed_updates(app: Application) -> list[str]:
+    """
+    Update types the registered handlers can use, so Telegram doesn't send (and wake us for) anything else.
+    """
+    types = set()
+    for handlers in app.handlers.values():
+        for handler in handlers:
+            kind = next((t for cls, t in _HANDLER_UPDATES.items() if isinstance(handler, cls)), None)
+            if kind is None:
+                # unknown handler type: don't risk filtering out what it needs
+                return Update.ALL_TYPES
+            types.add(kind)
+    return sorted(types)
+
+
+def _fmt_seconds(seconds: float) -> str:
+    return f"{seconds * 1000:.0f}ms" if seconds < 1 else f"{seconds:.2f}s"
+
+
+def _format_suggestions(suggestions, limit: int = 10) -> str:
+    lines = []
+    for line, sugg in suggestions[:limit]:
+        if sugg:
+            best = ", ".join(f"{s.normalized_key} ({s.score:.0%})" for s in sugg)
+            lines.append(f"- {line['raw_name']}: maybe {best}")
+        else:
+            lines.append(f"- {line['raw_name']}")
+    if len(suggestions) > limit:
+        lines.append(f"... and {len(suggestions) - limit} more")
+    return "\n".join(lines) + "\n" if lines else ""
+
+
 def _parse_account_from_caption(caption: str) -> str | None:
     # very simple: look for "account=..."
     lowered = caption.lower()
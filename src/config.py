@@ -6,6 +6,16 @@ import yaml
 @dataclass(frozen=True)
 class TelegramConfig:
     bot_token: str
+    mode: str = "polling"          # "polling" or "webhook"
+    webhook_url: str = ""          # public URL Telegram posts updates to; its path is served locally
+    webhook_listen: str = "127.0.0.1"
+    webhook_port: int = 8443
+    webhook_secret: str = ""       # checked on every update; empty = random per run
+    api_base_url: str = ""         # Bot API server, e.g. http://127.0.0.1:8081 for scripts/fake_telegram.py
+    send_per_s: float = 25.0       # outgoing messages per second, all chats together (Telegram allows ~30)
+    send_chat_per_s: float = 1.0   # outgoing messages per second to one chat...
+    send_chat_burst: int = 3       # ...after a burst of this many
+    send_max_retries: int = 5      # flood-limit (429) answers honored before a message is given up
 
 
 @dataclass(frozen=True)
@@ -13,6 +23,7 @@ class AppConfig:
     data_dir: Path
     db_path: Path
     downloads_dir: Path
+    save_images: bool = False   # keep uploaded photos in the image store (downloads_dir/images)
 
 
 @dataclass(frozen=True)
@@ -20,11 +31,91 @@ class DefaultsConfig:
     account: str
 
 
+@dataclass(frozen=True)
+class WorkersConfig:
+    ocr_processes: int = 2   # 0 = run OCR in the thread pool
+    io_threads: int = 4
+    max_queue: int = 20      # receipts accepted at once before "queue full"
+    album_window_s: float = 1.5   # how long to wait for the other photos of an album
+
+
+@dataclass(frozen=True)
+class CacheConfig:
+    mapping_max_entries: int = 50_000   # item_mappings rows kept in memory across all users
+    ocr_max_mb: int = 50                # OCR results kept in the ocr_cache table
+    state_max_sessions: int = 1000      # conversation states kept in memory
+    state_flush_s: float = 2.0          # changed states are written at least this often
+    state_flush_batch: int = 100        # ... or as soon as this many are waiting
+
+
+@dataclass(frozen=True)
+class DbConfig:
+    readers: int = 4             # read-only connections in the pool
+    write_batch_max: int = 64    # queued writes grouped into one commit
+    synchronous: str = "NORMAL"
+    mmap_size_mb: int = 64
+    cache_size_mb: int = 16
+
+
+@dataclass(frozen=True)
+class PreprocessConfig:
+    enabled: bool = True
+    grayscale: bool = True
+    auto_crop: bool = True
+    deskew: bool = True
+    max_skew_deg: float = 10.0
+    binarize: bool = True
+    target_dpi: int = 300           # 0 = never downscale
+    receipt_width_mm: float = 80.0  # thermal receipt paper width, used to turn DPI into pixels
+
+
+@dataclass(frozen=True)
+class FuzzyConfig:
+    top_k: int = 3
+    min_score: float = 0.5
+    auto_apply_threshold: float = 0.0   # 0 = never map automatically; e.g. 0.9 to accept near-identical keys
+
+
+@dataclass(frozen=True)
+class MetricsConfig:
+    persist_timings: bool = True   # write per-session stage timings to pipeline_timings
+    prometheus_port: int = 0       # 0 = no /metrics endpoint
+    prometheus_host: str = "127.0.0.1"
+
+
+@dataclass(frozen=True)
+class JobsConfig:
+    lease_s: int = 600            # a claimed job is handed out again after this long without progress
+    max_attempts: int = 5         # then the session is marked FAILED
+    backoff_base_s: float = 5.0   # retry delay doubles from here
+    poll_s: float = 5.0           # how often to look for jobs whose retry delay has elapsed
+
+
+@dataclass(frozen=True)
+class StorageConfig:
+    archive: bool = True            # re-encode stored photos once their receipt is processed
+    archive_format: str = "WEBP"
+    archive_quality: int = 60
+    archive_max_width: int = 1000   # px; 0 = keep size
+    max_age_days: int = 90          # delete older photos; 0 = keep forever
+    max_mb: int = 500               # then the oldest until the store fits; 0 = no limit
+    maintenance_interval_h: float = 24.0   # prune + SQLite incremental_vacuum/optimize
+    vacuum_pages: int = 0           # free pages returned per run; 0 = all
+
+
 @dataclass(frozen=True)
 class Config:
     telegram: TelegramConfig
     app: AppConfig
     defaults: DefaultsConfig
+    workers: WorkersConfig
+    cache: CacheConfig
+    db: DbConfig
+    preprocess: PreprocessConfig
+    fuzzy: FuzzyConfig
+    metrics: MetricsConfig
+    jobs: JobsConfig
+    storage: StorageConfig
 
 
 def load_config(path: str) -> Config:
@@ -36,7 +127,20 @@ def load_config(path: str) -> Config:
     downloads_dir = Path(raw["app"]["downloads_dir"])
 
     return Config(
-        telegram=TelegramConfig(bot_token=raw["telegram"]["bot_token"]),
-        app=AppConfig(data_dir=data_dir, db_path=db_path, downloads_dir=downloads_dir),
+        telegram=TelegramConfig(**raw["telegram"]),
+        app=AppConfig(
+            data_dir=data_dir,
+            db_path=db_path,
+            downloads_dir=downloads_dir,
+            save_images=bool(raw["app"].get("save_images", False)),
+        ),
         defaults=DefaultsConfig(account=raw["defaults"]["account"]),
+        workers=WorkersConfig(**(raw.get("workers") or {})),
+        cache=CacheConfig(**(raw.get("cache") or {})),
+        db=DbConfig(**(raw.get("db") or {})),
+        preprocess=PreprocessConfig(**(raw.get("preprocess") or {})),
+        fuzzy=FuzzyConfig(**(raw.get("fuzzy") or {})),
+        metrics=MetricsConfig(**(raw.get("metrics") or {})),
+        jobs=JobsConfig(**(raw.get("jobs") or {})),
+        storage=StorageConfig(**(raw.get("storage") or {})),
     )
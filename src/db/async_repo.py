@@ -0,0 +1,112 @@
+import asyncio
+from concurrent.futures import Executor
+from typing import Any, Callable, Iterator, Optional
+
+from src.db.db import Database
+from src.db.repo import Repo
+
+# Repo methods that only read. Everything else is sent to the writer thread.
+READ_METHODS = frozenset({
+    "get_user_id",
+    "get_default_account",
+    "find_mapping",
+    "find_mappings",
+    "load_mappings",
+    "get_session",
+    "get_line",
+    "list_lines",
+    "unresolved_lines",
+    "has_unresolved_lines",
+    "get_state",
+    "get_ocr_by_file_id",
+    "get_ocr_by_hash",
+    "ocr_cache_bytes",
+    "ingested_hashes",
+    "count_open_jobs",
+    "count_unresolved",
+    "spending_summary",
+    "last_export",
+    "get_stored_image",
+    "stored_images_to_prune",
+})
+
+# Read methods that return a generator over a live cursor; the connection is held until it is exhausted.
+STREAM_METHODS = frozenset({
+    "iter_export_rows",
+})
+
+
+class PooledRepo:
+    """
+    Same API as Repo, backed by a Database: reads use the read-only pool,
+    writes are queued to the writer thread and block until committed.
+    Safe to call from any thread.
+    """
+
+    def __init__(self, db: Database):
+        self.db = db
+
+    def __getattr__(self, name: str) -> Callable[..., Any]:
+        if name.startswith("_") or not callable(getattr(Repo, name, None)):
+            raise AttributeError(name)
+
+        if name in STREAM_METHODS:
+            def stream(*args: Any, **kwargs: Any) -> Iterator[Any]:
+                with self.db.reader() as conn:
+                    yield from getattr(Repo(conn), name)(*args, **kwargs)
+            return stream
+
+        if name in READ_METHODS:
+            def read(*args: Any, **kwargs: Any) -> Any:
+                with self.db.reader() as conn:
+                    return getattr(Repo(conn), name)(*args, **kwargs)
+            return read
+
+        def write(*args: Any, **kwargs: Any) -> Any:
+            return self.db.write(lambda conn: getattr(Repo(conn, autocommit=False), name)(*args, **kwargs))
+        return write
+
+    def get_or_create_user(self, telegram_user_id: str, default_account: Optional[str]) -> int:
+        # called on every update; only go through the writer for new users
+        user_id = self.get_user_id(telegram_user_id)
+        if user_id is not None:
+            return user_id
+        return self.db.write(lambda conn: Repo(conn, autocommit=False).get_or_create_user(telegram_user_id, default_account))
+
+
+class AsyncRepo:
+    """
+    Awaitable Repo facade for the bot handlers.
+
+    Writes await the writer thread's future directly; reads run in `executor`
+    (the default loop executor if None) so the event loop never touches SQLite.
+    """
+
+    def __init__(self, db: Database, executor: Optional[Executor] = None):
+        self.db = db
+        self.sync = PooledRepo(db)
+        self._executor = executor
+
+    def __getattr__(self, name: str) -> Callable[..., Any]:
+        if name.startswith("_") or not callable(getattr(Repo, name, None)):
+            raise AttributeError(name)
+        if name in STREAM_METHODS:
+            raise AttributeError(f"{name} streams rows; iterate PooledRepo.{name} in a worker thread instead")
+
+        if name in READ_METHODS:
+            async def read(*args: Any, **kwargs: Any) -> Any:
+                fn = getattr(self.sync, name)
+                return await asyncio.get_running_loop().run_in_executor(self._executor, lambda: fn(*args, **kwargs))
+            return read
+
+        async def write(*args: Any, **kwargs: Any) -> Any:
+            fut = self.db.submit_write(lambda conn: getattr(Repo(conn, autocommit=False), name)(*args, **kwargs))
+            return await asyncio.wrap_future(fut)
+        return write
+
+    async def get_or_create_user(self, telegram_user_id: str, default_account: Optional[str]) -> int:
+        user_id = await self.get_user_id(telegram_user_id)
+        if user_id is not None:
+            return user_id
+        fut = self.db.submit_write(lambda conn: Repo(conn, autocommit=False).get_or_create_user(telegram_user_id, default_account))
+        return await asyncio.wrap_future(fut)
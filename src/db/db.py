@@ -1,15 +1,195 @@
+import logging
+import queue
 import sqlite3
+import threading
+from concurrent.futures import Future
+from contextlib import contextmanager
+from dataclasses import dataclass, field
 from pathlib import Path
+from typing import Any, Callable, Iterator, Optional
 
+from src.db.migrations import Migration, migrate
 
-def connect(db_path: Path) -> sqlite3.Connection:
+log = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class Pragmas:
+    synchronous: str = "NORMAL"         # safe with WAL: only the last commits can be lost on power failure
+    mmap_size: int = 64 * 1024 * 1024
+    cache_size_kb: int = 16 * 1024
+    busy_timeout_ms: int = 5000
+
+
+def _apply_pragmas(conn: sqlite3.Connection, pragmas: Pragmas, writer: bool) -> None:
+    conn.execute("PRAGMA foreign_keys = ON;")
+    conn.execute(f"PRAGMA busy_timeout = {int(pragmas.busy_timeout_ms)};")
+    conn.execute(f"PRAGMA mmap_size = {int(pragmas.mmap_size)};")
+    conn.execute(f"PRAGMA cache_size = -{int(pragmas.cache_size_kb)};")  # negative = KiB
+    if writer:
+        # journal_mode is persistent in the file; readers inherit it
+        conn.execute("PRAGMA journal_mode = WAL;")
+        conn.execute(f"PRAGMA synchronous = {pragmas.synchronous};")
+
+
+def connect(db_path: Path, pragmas: Pragmas = Pragmas()) -> sqlite3.Connection:
     db_path.parent.mkdir(parents=True, exist_ok=True)
-    conn = sqlite3.connect(str(db_path))
+    conn = sqlite3.connect(str(db_path), check_same_thread=False)  # used from worker threads
     conn.row_factory = sqlite3.Row
-    conn.execute("PRAGMA foreign_keys = ON;")
+    _apply_pragmas(conn, pragmas, writer=True)
     return conn
 
 
-def init_db(conn: sqlite3.Connection, schema_sql: str) -> None:
-    conn.executescript(schema_sql)
+def connect_readonly(db_path: Path, pragmas: Pragmas = Pragmas()) -> sqlite3.Connection:
+    conn = sqlite3.connect(f"{db_path.resolve().as_uri()}?mode=ro", uri=True, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    _apply_pragmas(conn, pragmas, writer=False)
+    return conn
+
+
+def init_db(conn: sqlite3.Connection) -> list[Migration]:
+    """
+    Prepare the database file and apply pending schema migrations (a no-op when it is current).
+    """
+    _enable_incremental_vacuum(conn)
+    return migrate(conn)
+
+
+def _enable_incremental_vacuum(conn: sqlite3.Connection) -> None:
+    # lets Database.maintain() hand free pages back to the OS without a full VACUUM
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+        return
     conn.commit()
+    conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    conn.execute("VACUUM")  # the mode only takes effect on an existing file after one full VACUUM
+
+
+@dataclass
+class _WriteJob:
+    fn: Callable[[sqlite3.Connection], Any]
+    future: Future = field(default_factory=Future)
+
+
+_STOP = object()
+
+
+class Database:
+    """
+    WAL database with a pool of read-only connections and a single writer thread.
+
+    Writes are queued as callables fn(conn). The writer takes everything that is queued
+    (up to batch_max), runs each call inside its own SAVEPOINT and commits the batch once.
+    A failing call only rolls back its own savepoint. Futures resolve after the commit.
+    """
+
+    def __init__(self, db_path: Path, readers: int = 4, batch_max: int = 64, pragmas: Pragmas = Pragmas()):
+        self.db_path = db_path
+        self.batch_max = batch_max
+        self.pragmas = pragmas
+
+        self._writer_conn = connect(db_path, pragmas)
+        self._writer_conn.isolation_level = None  # BEGIN/COMMIT are issued by the writer loop
+        self._writes: "queue.Queue[Any]" = queue.Queue()
+        self._writer = threading.Thread(target=self._write_loop, name="db-writer", daemon=True)
+        self._writer.start()
+
+        self._readers: "queue.Queue[sqlite3.Connection]" = queue.Queue()
+        for _ in range(readers):
+            self._readers.put(connect_readonly(db_path, pragmas))
+        self._reader_count = readers
+
+    # ---------- reads ----------
+    @contextmanager
+    def reader(self) -> Iterator[sqlite3.Connection]:
+        conn = self._readers.get()
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            self._readers.put(conn)
+
+    # ---------- writes ----------
+    def submit_write(self, fn: Callable[[sqlite3.Connection], Any]) -> Future:
+        job = _WriteJob(fn)
+        self._writes.put(job)
+        return job.future
+
+    def write(self, fn: Callable[[sqlite3.Connection], Any]) -> Any:
+        return self.submit_write(fn).result()
+
+    def _write_loop(self) -> None:
+        conn = self._writer_conn
+        while True:
+            first = self._writes.get()
+            if first is _STOP:
+                return
+            batch = [first]
+            while len(batch) < self.batch_max:
+                try:
+                    nxt = self._writes.get_nowait()
+                except queue.Empty:
+                    break
+                if nxt is _STOP:
+                    self._writes.put(_STOP)
+                    break
+                batch.append(nxt)
+
+            results: list[tuple[_WriteJob, Any, Optional[BaseException]]] = []
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                for job in batch:
+                    conn.execute("SAVEPOINT job")
+                    try:
+                        value = job.fn(conn)
+                    except BaseException as e:
+                        conn.execute("ROLLBACK TO job")
+                        conn.execute("RELEASE job")
+                        results.append((job, None, e))
+                    else:
+                        conn.execute("RELEASE job")
+                        results.append((job, value, None))
+                conn.execute("COMMIT")
+            except BaseException as e:
+                log.exception("write batch failed")
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK")
+                for job in batch:
+                    job.future.set_exception(e)
+                continue
+
+            for job, value, err in results:
+                if err is None:
+                    job.future.set_result(value)
+                else:
+                    job.future.set_exception(err)
+
+    def maintain(self, vacuum_pages: int = 0) -> int:
+        """
+        Give free pages back to the OS (up to vacuum_pages, 0 = all) and refresh the query planner's statistics.
+        Returns the number of free pages before.
+        """
+        def run(conn: sqlite3.Connection) -> int:
+            free = int(conn.execute("PRAGMA freelist_count").fetchone()[0])
+            # each step of incremental_vacuum frees one page, and the sqlite3 module steps a
+            # PRAGMA that returns no columns only once, so run it once per page
+            for _ in range(min(free, vacuum_pages) if vacuum_pages else free):
+                conn.execute("PRAGMA incremental_vacuum(1)")
+            conn.execute("PRAGMA optimize")
+            return free
+
+        free = self.write(run)
+        # the file only shrinks once the WAL has been checkpointed into it
+        conn = connect(self.db_path, self.pragmas)
+        try:
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchall()
+        finally:
+            conn.close()
+        return free
+
+    def close(self) -> None:
+        self._writes.put(_STOP)
+        self._writer.join()
+        self._writer_conn.close()
+        for _ in range(self._reader_count):
+            self._readers.get().close()
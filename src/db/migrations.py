@@ -0,0 +1,145 @@
+import logging
+import sqlite3
+import time
+from pathlib import Path
+from typing import Callable, NamedTuple
+
+from src.db.repo import Repo
+
+log = logging.getLogger(__name__)
+
+SCHEMA_PATH = Path(__file__).with_name("schema.sql")
+
+
+class Migration(NamedTuple):
+    version: int
+    name: str
+    apply: Callable[[sqlite3.Connection], None]
+
+
+def _statements(sql: str) -> list[str]:
+    """
+    Split a script into statements, so it can run inside a transaction (executescript commits first).
+    """
+    out, buf = [], ""
+    for line in sql.splitlines(keepends=True):
+        buf += line
+        if sqlite3.complete_statement(buf):
+            stmt = buf.strip()
+            if stmt.strip(";").strip():
+                out.append(stmt)
+            buf = ""
+    return out
+
+
+def _baseline(conn: sqlite3.Connection) -> None:
+    # Databases from before versioning may have any older subset of the schema: every
+    # CREATE is IF NOT EXISTS, and what the old schema lacked is added below.
+    had_summary = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type='table' AND name='spending_summary'"
+    ).fetchone() is not None
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(receipt_sessions)")}
+
+    for stmt in _statements(SCHEMA_PATH.read_text(encoding="utf-8")):
+        conn.execute(stmt)
+
+    if columns and "unresolved_count" not in columns:
+        conn.execute("ALTER TABLE receipt_sessions ADD COLUMN unresolved_count INTEGER NOT NULL DEFAULT 0")
+        conn.execute(
+            """UPDATE receipt_sessions SET unresolved_count = (
+                 SELECT COUNT(*) FROM receipt_lines l WHERE l.session_id = receipt_sessions.id AND l.mapping_id IS NULL
+               )"""
+        )
+    if not had_summary:
+        Repo(conn, autocommit=False).rebuild_spending_summary()
+
+
+_EXPORT_WATERMARKS_SQL = """
+-- Bumped whenever a line is inserted or gets a (different) mapping, from one increasing
+-- sequence: what changed after an export has a higher change_seq than anything it contained.
+ALTER TABLE receipt_lines ADD COLUMN change_seq INTEGER NOT NULL DEFAULT 0;
+UPDATE receipt_lines SET change_seq = id;
+CREATE INDEX idx_receipt_lines_change_seq ON receipt_lines(change_seq);
+
+-- One row per export that advances the user's watermark (incremental exports)
+CREATE TABLE export_log (
+  id              INTEGER PRIMARY KEY AUTOINCREMENT,
+  user_id         INTEGER NOT NULL,
+  change_seq      INTEGER NOT NULL,   -- highest receipt_lines.change_seq exported so far
+  max_line_id     INTEGER NOT NULL,
+  max_session_id  INTEGER NOT NULL,
+  row_count       INTEGER NOT NULL,
+  created_at      TEXT NOT NULL DEFAULT (datetime('now')),
+  FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE
+);
+CREATE INDEX idx_export_log_user ON export_log(user_id, id);
+"""
+
+
+def _export_watermarks(conn: sqlite3.Connection) -> None:
+    for stmt in _statements(_EXPORT_WATERMARKS_SQL):
+        conn.execute(stmt)
+
+
+_CHANGE_SEQ_COUNTER_SQL = """
+-- The last change_seq handed out. MAX(receipt_lines.change_seq) can go down when lines are
+-- deleted (a retried job re-ingests its session), which would reuse values below a watermark.
+CREATE TABLE change_seq (
+  id              INTEGER PRIMARY KEY CHECK (id = 1),
+  value           INTEGER NOT NULL
+);
+INSERT INTO change_seq (id, value)
+SELECT 1, MAX(
+  (SELECT COALESCE(MAX(change_seq), 0) FROM receipt_lines),
+  (SELECT COALESCE(MAX(change_seq), 0) FROM export_log)
+);
+"""
+
+
+def _change_seq_counter(conn: sqlite3.Connection) -> None:
+    for stmt in _statements(_CHANGE_SEQ_COUNTER_SQL):
+        conn.execute(stmt)
+
+
+# Append only; never edit or reorder a released migration.
+MIGRATIONS: list[Migration] = [
+    Migration(1, "baseline schema", _baseline),
+    Migration(2, "export watermarks", _export_watermarks),
+    Migration(3, "change_seq counter", _change_seq_counter),
+]
+
+
+def schema_version(conn: sqlite3.Connection) -> int:
+    return int(conn.execute("PRAGMA user_version").fetchone()[0])
+
+
+def migrate(conn: sqlite3.Connection, migrations: list[Migration] = MIGRATIONS) -> list[Migration]:
+    """
+    Bring the database to the latest version. Each migration and its user_version bump commit
+    together, so a failed migration leaves the database at the previous version.
+    Returns the migrations that were applied (none when the database is current).
+    """
+    current = schema_version(conn)
+    latest = migrations[-1].version if migrations else 0
+    if current == latest:
+        return []
+    if current > latest:
+        raise RuntimeError(f"database schema version {current} is newer than this code ({latest})")
+
+    applied = []
+    for m in migrations:
+        if m.version <= current:
+            continue
+        t0 = time.perf_counter()
+        conn.commit()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            m.apply(conn)
+            conn.execute(f"PRAGMA user_version = {int(m.version)}")
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        log.info("migration %s (%s) applied in %.0f ms", m.version, m.name, (time.perf_counter() - t0) * 1000)
+        applied.append(m)
+    return applied
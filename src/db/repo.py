@@ -1,32 +1,119 @@
 import json
 import sqlite3
-from typing import Optional, Any
+from collections import Counter
+from contextlib import contextmanager
+from typing import Optional, Any, Iterable, Iterator, NamedTuple, Protocol
+
+from src.mapping.normalize import normalize_item_name
+
+# SQLite's default SQLITE_MAX_VARIABLE_NUMBER is 999 on older builds
+_IN_CHUNK = 900
+
+
+# One row per mapped line; unresolved lines drop out of the inner join.
+_EXPORT_SQL = """
+SELECT s.receipt_date, s.account, m.category, m.subcategory, l.raw_name, l.amount,
+       s.id AS session_id, l.id AS line_id, l.change_seq
+FROM receipt_sessions s
+JOIN receipt_lines l ON l.session_id = s.id
+JOIN item_mappings m ON m.id = l.mapping_id
+WHERE {where}
+ORDER BY s.id ASC, l.id ASC
+"""
+
+# receipt_date is stored as mm/dd/yyyy; this turns it into a sortable yyyy-mm-dd
+_ISO_RECEIPT_DATE = "substr(s.receipt_date, 7, 4) || '-' || substr(s.receipt_date, 1, 2) || '-' || substr(s.receipt_date, 4, 2)"
+
+# yyyy-mm of a session's receipt_date
+_RECEIPT_MONTH = "substr(s.receipt_date, 7, 4) || '-' || substr(s.receipt_date, 1, 2)"
+
+# Adds sign * (sum, count) of the mapped lines matching {where} to spending_summary
+_SUMMARY_SQL = f"""
+INSERT INTO spending_summary (user_id, month, category, subcategory, total, line_count)
+SELECT s.user_id, {_RECEIPT_MONTH}, m.category, m.subcategory, ? * SUM(l.amount), ? * COUNT(*)
+FROM receipt_lines l
+JOIN receipt_sessions s ON s.id = l.session_id
+JOIN item_mappings m ON m.id = l.mapping_id
+WHERE {{where}}
+GROUP BY 1, 2, 3, 4
+ON CONFLICT(user_id, month, category, subcategory)
+DO UPDATE SET total = total + excluded.total, line_count = line_count + excluded.line_count
+"""
+
+
+class ParsedLineLike(Protocol):
+    raw_name: str
+    amount: float
+    confidence: float
+
+
+class Resolution(NamedTuple):
+    """
+    The user's decision for one unknown line. canonical_name defaults to the line's raw_name.
+    """
+    line_id: int
+    category: str
+    subcategory: str
+    canonical_name: Optional[str] = None
 
 
 class Repo:
-    def __init__(self, conn: sqlite3.Connection):
+    def __init__(self, conn: sqlite3.Connection, autocommit: bool = True):
+        """
+        autocommit=False is used by the DB writer thread, which commits a whole batch of calls at once.
+        """
         self.conn = conn
+        self.autocommit = autocommit
+
+    def _commit(self) -> None:
+        if self.autocommit:
+            self.conn.commit()
+
+    def _next_change_seq(self) -> int:
+        """
+        Next value for receipt_lines.change_seq. Call it inside the write transaction: the counter row stays
+        locked until commit, so values follow commit order and never repeat, even when lines are deleted.
+        """
+        return int(self.conn.execute("UPDATE change_seq SET value = value + 1 RETURNING value").fetchall()[0][0])
+
+    @contextmanager
+    def _tx(self):
+        """
+        Group several statements; rolled back on error when this Repo owns the transaction.
+        """
+        if not self.autocommit:
+            yield
+            return
+        self.autocommit = False  # nested Repo calls must not commit halfway
+        try:
+            with self.conn:
+                yield
+        finally:
+            self.autocommit = True
 
     # ---------- users ----------
-    def get_or_create_user(self, telegram_user_id: str, default_account: Optional[str]) -> int:
-        cur = self.conn.execute(
+    def get_user_id(self, telegram_user_id: str) -> Optional[int]:
+        row = self.conn.execute(
             "SELECT id FROM users WHERE telegram_user_id = ?",
             (telegram_user_id,),
-        )
-        row = cur.fetchone()
-        if row:
-            return int(row["id"])
+        ).fetchone()
+        return int(row["id"]) if row else None
+
+    def get_or_create_user(self, telegram_user_id: str, default_account: Optional[str]) -> int:
+        user_id = self.get_user_id(telegram_user_id)
+        if user_id is not None:
+            return user_id
 
         self.conn.execute(
             "INSERT INTO users (telegram_user_id, default_account) VALUES (?, ?)",
             (telegram_user_id, default_account),
         )
-        self.conn.commit()
+        self._commit()
         return int(self.conn.execute("SELECT last_insert_rowid()").fetchone()[0])
 
     def set_default_account(self, user_id: int, account: str) -> None:
         self.conn.execute("UPDATE users SET default_account = ? WHERE id = ?", (account, user_id))
-        self.conn.commit()
+        self._commit()
 
     def get_default_account(self, user_id: int) -> Optional[str]:
         row = self.conn.execute("SELECT default_account FROM users WHERE id = ?", (user_id,)).fetchone()
@@ -39,16 +126,30 @@ class Repo:
             (user_id, normalized_key),
         ).fetchone()
 
+    def load_mappings(self, user_id: int) -> dict[str, int]:
+        cur = self.conn.execute("SELECT normalized_key, id FROM item_mappings WHERE user_id = ?", (user_id,))
+        return {row["normalized_key"]: int(row["id"]) for row in cur}
+
     def upsert_mapping(self, user_id: int, normalized_key: str, canonical_name: str, category: str, subcategory: str) -> int:
         existing = self.find_mapping(user_id, normalized_key)
         if existing:
-            self.conn.execute(
-                """UPDATE item_mappings
-                   SET canonical_name=?, category=?, subcategory=?, updated_at=datetime('now')
-                   WHERE id=?""",
-                (canonical_name, category, subcategory, existing["id"]),
-            )
-            self.conn.commit()
+            recategorized = (existing["category"], existing["subcategory"]) != (category, subcategory)
+            with self._tx():
+                if recategorized:
+                    self._summarize(-1, "l.mapping_id = ?", (existing["id"],))
+                self.conn.execute(
+                    """UPDATE item_mappings
+                       SET canonical_name=?, category=?, subcategory=?, updated_at=datetime('now')
+                       WHERE id=?""",
+                    (canonical_name, category, subcategory, existing["id"]),
+                )
+                if recategorized:
+                    self._summarize(+1, "l.mapping_id = ?", (existing["id"],))
+                    # its lines export differently now: /export new must carry them again
+                    self.conn.execute(
+                        "UPDATE receipt_lines SET change_seq=? WHERE mapping_id=?",
+                        (self._next_change_seq(), existing["id"]),
+                    )
             return int(existing["id"])
 
         self.conn.execute(
@@ -56,9 +157,26 @@ class Repo:
                VALUES (?, ?, ?, ?, ?)""",
             (user_id, normalized_key, canonical_name, category, subcategory),
         )
-        self.conn.commit()
+        self._commit()
         return int(self.conn.execute("SELECT last_insert_rowid()").fetchone()[0])
 
+    def find_mappings(self, user_id: int, normalized_keys: Iterable[str]) -> dict[str, int]:
+        """
+        Set-based lookup: {normalized_key: mapping_id} for the keys that have a mapping.
+        """
+        keys = list(dict.fromkeys(normalized_keys))
+        found: dict[str, int] = {}
+        for i in range(0, len(keys), _IN_CHUNK):
+            chunk = keys[i:i + _IN_CHUNK]
+            placeholders = ",".join("?" * len(chunk))
+            cur = self.conn.execute(
+                f"SELECT normalized_key, id FROM item_mappings WHERE user_id = ? AND normalized_key IN ({placeholders})",
+                (user_id, *chunk),
+            )
+            for row in cur:
+                found[row["normalized_key"]] = int(row["id"])
+        return found
+
     # ---------- receipt sessions ----------
     def create_session(self, user_id: int, account: str, receipt_date: str, image_path: str | None) -> int:
         self.conn.execute(
@@ -66,7 +184,7 @@ class Repo:
                VALUES (?, ?, ?, 'PROCESSING', ?)""",
             (user_id, account, receipt_date, image_path),
         )
-        self.conn.commit()
+        self._commit()
         return int(self.conn.execute("SELECT last_insert_rowid()").fetchone()[0])
 
     def set_session_store(self, session_id: int, store: str) -> None:
@@ -74,14 +192,14 @@ class Repo:
             "UPDATE receipt_sessions SET store=?, updated_at=datetime('now') WHERE id=?",
             (store, session_id),
         )
-        self.conn.commit()
+        self._commit()
 
     def set_session_status(self, session_id: int, status: str) -> None:
         self.conn.execute(
             "UPDATE receipt_sessions SET status=?, updated_at=datetime('now') WHERE id=?",
             (status, session_id),
         )
-        self.conn.commit()
+        self._commit()
 
     def get_session(self, session_id: int) -> sqlite3.Row:
         row = self.conn.execute("SELECT * FROM receipt_sessions WHERE id=?", (session_id,)).fetchone()
@@ -92,12 +210,62 @@ class Repo:
     # ---------- receipt lines ----------
     def add_line(self, session_id: int, raw_name: str, normalized_key: str, amount: float, confidence: float = 0.0) -> int:
         self.conn.execute(
-            """INSERT INTO receipt_lines (session_id, raw_name, normalized_key, amount, confidence)
-               VALUES (?, ?, ?, ?, ?)""",
-            (session_id, raw_name, normalized_key, amount, confidence),
+            """INSERT INTO receipt_lines (session_id, raw_name, normalized_key, amount, confidence, change_seq)
+               VALUES (?, ?, ?, ?, ?, ?)""",
+            (session_id, raw_name, normalized_key, amount, confidence, self._next_change_seq()),
         )
-        self.conn.commit()
-        return int(self.conn.execute("SELECT last_insert_rowid()").fetchone()[0])
+        line_id = int(self.conn.execute("SELECT last_insert_rowid()").fetchone()[0])
+        self.conn.execute("UPDATE receipt_sessions SET unresolved_count = unresolved_count + 1 WHERE id=?", (session_id,))
+        self._commit()
+        return line_id
+
+    def ingest_lines(
+        self,
+        session_id: int,
+        user_id: int,
+        parsed_lines: Iterable[ParsedLineLike],
+        mapping_ids: Optional[dict[str, int]] = None,
+    ) -> int:
+        """
+        Insert all parsed lines of a session in one transaction.
+
+        Lines are normalized, mapped with `mapping_ids` ({normalized_key: mapping_id}, resolved by the
+        caller before the write, e.g. through a MappingCache) or else one find_mappings query, inserted
+        with executemany, and the session is moved to AWAITING_USER or DONE.
+        Lines already stored for the session are replaced, so a retried job does not duplicate them.
+        Returns the number of lines left without a mapping.
+        """
+        rows = [(pl.raw_name, normalize_item_name(pl.raw_name), float(pl.amount), float(pl.confidence)) for pl in parsed_lines]
+        if mapping_ids is None:
+            mapping_ids = self.find_mappings(user_id, [nk for _, nk, _, _ in rows])
+
+        unknown = 0
+        params = []
+        for raw_name, nk, amount, confidence in rows:
+            mapping_id = mapping_ids.get(nk)
+            if mapping_id is None:
+                unknown += 1
+            params.append((session_id, raw_name, nk, amount, confidence, mapping_id, int(mapping_id is None)))
+
+        status = "AWAITING_USER" if unknown else "DONE"
+        with self._tx():
+            self._summarize(-1, "l.session_id = ?", (session_id,))
+            self.conn.execute("DELETE FROM receipt_lines WHERE session_id=?", (session_id,))
+            seq = self._next_change_seq()
+            self.conn.executemany(
+                """INSERT INTO receipt_lines (session_id, raw_name, normalized_key, amount, confidence, mapping_id, needs_review, change_seq)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
+                [(*p, seq) for p in params],
+            )
+            self._summarize(+1, "l.session_id = ?", (session_id,))
+            self.conn.execute(
+                "UPDATE receipt_sessions SET status=?, unresolved_count=?, updated_at=datetime('now') WHERE id=?",
+                (status, unknown, session_id),
+            )
+        return unknown
+
+    def get_line(self, line_id: int) -> Optional[sqlite3.Row]:
+        return self.conn.execute("SELECT * FROM receipt_lines WHERE id=?", (line_id,)).fetchone()
 
     def list_lines(self, session_id: int) -> list[sqlite3.Row]:
         cur = self.conn.execute(
@@ -107,11 +275,94 @@ class Repo:
         return list(cur.fetchall())
 
     def set_line_mapping(self, line_id: int, mapping_id: int) -> None:
-        self.conn.execute(
-            "UPDATE receipt_lines SET mapping_id=?, needs_review=0 WHERE id=?",
-            (mapping_id, line_id),
-        )
-        self.conn.commit()
+        with self._tx():
+            line = self.conn.execute("SELECT session_id, mapping_id FROM receipt_lines WHERE id=?", (line_id,)).fetchone()
+            if line is None:
+                return
+            self._summarize(-1, "l.id = ?", (line_id,))
+            self.conn.execute(
+                "UPDATE receipt_lines SET mapping_id=?, needs_review=0, change_seq=? WHERE id=?",
+                (mapping_id, self._next_change_seq(), line_id),
+            )
+            self._summarize(+1, "l.id = ?", (line_id,))
+            if line["mapping_id"] is None:
+                self.conn.execute(
+                    "UPDATE receipt_sessions SET unresolved_count = unresolved_count - 1 WHERE id=?", (line["session_id"],)
+                )
+
+    def resolve_lines(self, user_id: int, resolutions: Iterable[Resolution]) -> tuple[dict[str, int], dict[int, int]]:
+        """
+        Apply many decisions in one transaction.
+
+        Each decision upserts the mapping for its line's normalized_key, and that mapping is then
+        attached to every unresolved line with the same key in the user's open sessions (not only
+        the decided line). unresolved_count is decremented per session and sessions reaching 0 are
+        marked DONE. Lines that don't belong to the user are ignored.
+
+        Returns ({normalized_key: mapping_id}, {session_id: unresolved lines left}) for the touched sessions.
+        """
+        resolutions = list(resolutions)
+        lines: dict[int, sqlite3.Row] = {}
+        ids = [r.line_id for r in resolutions]
+        for i in range(0, len(ids), _IN_CHUNK):
+            chunk = ids[i:i + _IN_CHUNK]
+            cur = self.conn.execute(
+                f"""SELECT l.id, l.session_id, l.raw_name, l.normalized_key, l.mapping_id
+                    FROM receipt_lines l JOIN receipt_sessions s ON s.id = l.session_id
+                    WHERE s.user_id = ? AND l.id IN ({",".join("?" * len(chunk))})""",
+                [user_id, *chunk],
+            )
+            lines.update((row["id"], row) for row in cur)
+
+        # one mapping per key; the last decision for a key wins
+        decisions: dict[str, tuple[Resolution, sqlite3.Row]] = {}
+        for r in resolutions:
+            line = lines.get(r.line_id)
+            if line is not None:
+                decisions[line["normalized_key"]] = (r, line)
+
+        mapping_ids: dict[str, int] = {}
+        resolved: Counter[int] = Counter()
+        touched: set[int] = set()
+        newly_mapped: list[int] = []
+        with self._tx():
+            for nk, (r, line) in decisions.items():
+                mapping_id = self.upsert_mapping(user_id, nk, r.canonical_name or line["raw_name"], r.category, r.subcategory)
+                mapping_ids[nk] = mapping_id
+                touched.add(line["session_id"])
+                if line["mapping_id"] is not None and line["mapping_id"] != mapping_id:
+                    # remapping an already resolved line to this key's mapping
+                    self.set_line_mapping(line["id"], mapping_id)
+                cur = self.conn.execute(
+                    """UPDATE receipt_lines SET mapping_id=?, needs_review=0, change_seq=?
+                       WHERE mapping_id IS NULL AND normalized_key=?
+                         AND session_id IN (SELECT id FROM receipt_sessions WHERE user_id=? AND unresolved_count > 0)
+                       RETURNING id, session_id""",
+                    (mapping_id, self._next_change_seq(), nk, user_id),
+                )
+                rows = cur.fetchall()
+                resolved.update(row["session_id"] for row in rows)
+                newly_mapped.extend(row["id"] for row in rows)
+
+            # the lines had no mapping before, so they only add to the summary
+            for i in range(0, len(newly_mapped), _IN_CHUNK):
+                chunk = newly_mapped[i:i + _IN_CHUNK]
+                self._summarize(+1, f"l.id IN ({','.join('?' * len(chunk))})", chunk)
+
+            remaining: dict[int, int] = {}
+            for session_id, n in resolved.items():
+                row = self.conn.execute(
+                    """UPDATE receipt_sessions
+                       SET unresolved_count = unresolved_count - ?,
+                           status = CASE WHEN unresolved_count - ? <= 0 AND status = 'AWAITING_USER' THEN 'DONE' ELSE status END,
+                           updated_at = datetime('now')
+                       WHERE id=? RETURNING unresolved_count""",
+                    (n, n, session_id),
+                ).fetchone()
+                remaining[session_id] = int(row["unresolved_count"])
+            for session_id in touched - remaining.keys():
+                remaining[session_id] = self.count_unresolved(session_id)
+        return mapping_ids, remaining
 
     def unresolved_lines(self, session_id: int) -> list[sqlite3.Row]:
         cur = self.conn.execute(
@@ -120,16 +371,345 @@ class Repo:
         )
         return list(cur.fetchall())
 
-    # ---------- session state ----------
-    def set_state(self, session_id: int, state: dict[str, Any]) -> None:
-        payload = json.dumps(state, ensure_ascii=False)
+    def has_unresolved_lines(self, session_id: int) -> bool:
+        return self.count_unresolved(session_id) > 0
+
+    def count_unresolved(self, session_id: int) -> int:
+        row = self.conn.execute("SELECT unresolved_count FROM receipt_sessions WHERE id=?", (session_id,)).fetchone()
+        return int(row["unresolved_count"]) if row else 0
+
+    # ---------- spending summary ----------
+    def _summarize(self, sign: int, where: str, params: Iterable[Any]) -> None:
+        """
+        Add (sign=+1) or remove (sign=-1) the contribution of the mapped lines matching `where`
+        (over receipt_lines l, receipt_sessions s, item_mappings m). Call inside a transaction,
+        before and after changing those lines.
+        """
+        self.conn.execute(_SUMMARY_SQL.format(where=where), (sign, sign, *params))
+
+    def rebuild_spending_summary(self, user_id: Optional[int] = None) -> None:
+        """
+        Recompute the summary from receipt_lines, for one user or everyone.
+        """
+        with self._tx():
+            if user_id is None:
+                self.conn.execute("DELETE FROM spending_summary")
+                self._summarize(+1, "1", ())
+            else:
+                self.conn.execute("DELETE FROM spending_summary WHERE user_id=?", (user_id,))
+                self._summarize(+1, "s.user_id = ?", (user_id,))
+
+    def spending_summary(self, user_id: int, month: str) -> list[sqlite3.Row]:
+        """
+        (category, subcategory, total, line_count) of a yyyy-mm month, largest first.
+        """
+        cur = self.conn.execute(
+            """SELECT category, subcategory, total, line_count FROM spending_summary
+               WHERE user_id=? AND month=? AND line_count > 0
+               ORDER BY total DESC""",
+            (user_id, month),
+        )
+        return list(cur.fetchall())
+
+    # ---------- export ----------
+    def iter_export_rows(
+        self,
+        user_id: int,
+        session_id: Optional[int] = None,
+        date_from: Optional[str] = None,
+        date_to: Optional[str] = None,
+        status: Optional[str] = None,
+        since_seq: Optional[int] = None,
+    ) -> Iterator[sqlite3.Row]:
+        """
+        Stream export rows (receipt_date, account, category, subcategory, raw_name, amount) with one JOIN.
+
+        date_from/date_to are inclusive ISO dates (yyyy-mm-dd) compared against receipt_date.
+        since_seq keeps only lines created or remapped after that change_seq (a range on its index).
+        """
+        where = ["s.user_id = ?"]
+        params: list[Any] = [user_id]
+        if session_id is not None:
+            where.append("s.id = ?")
+            params.append(session_id)
+        if status is not None:
+            where.append("s.status = ?")
+            params.append(status)
+        if date_from is not None:
+            where.append(f"{_ISO_RECEIPT_DATE} >= ?")
+            params.append(date_from)
+        if date_to is not None:
+            where.append(f"{_ISO_RECEIPT_DATE} <= ?")
+            params.append(date_to)
+        if since_seq is not None:
+            where.append("l.change_seq > ?")
+            params.append(since_seq)
+            # unary + keeps the planner off the user index: the few lines changed since the
+            # watermark are found by range on idx_receipt_lines_change_seq, however long the history
+            where[0] = "+s.user_id = ?"
+
+        yield from self.conn.execute(_EXPORT_SQL.format(where=" AND ".join(where)), params)
+
+    def last_export(self, user_id: int) -> Optional[sqlite3.Row]:
+        """
+        The user's latest export_log entry (their watermark), or None if they never exported incrementally.
+        """
+        return self.conn.execute(
+            "SELECT * FROM export_log WHERE user_id=? ORDER BY id DESC LIMIT 1", (user_id,)
+        ).fetchone()
+
+    def log_export(self, user_id: int, change_seq: int, max_line_id: int, max_session_id: int, row_count: int) -> None:
+        self.conn.execute(
+            """INSERT INTO export_log (user_id, change_seq, max_line_id, max_session_id, row_count)
+               VALUES (?, ?, ?, ?, ?)""",
+            (user_id, change_seq, max_line_id, max_session_id, row_count),
+        )
+        self._commit()
+
+    # ---------- receipt jobs ----------
+    def create_job(self, user_id: int, account: str, receipt_date: str, chat_id: int, message_id: int, payload: dict[str, Any]) -> tuple[int, int]:
+        """
+        Create the session and its durable job together. Returns (job_id, session_id).
+        """
+        with self._tx():
+            session_id = self.create_session(user_id, account, receipt_date, None)
+            cur = self.conn.execute(
+                """INSERT INTO receipt_jobs (session_id, user_id, chat_id, message_id, payload_json)
+                   VALUES (?, ?, ?, ?, ?)""",
+                (session_id, user_id, chat_id, message_id, json.dumps(payload, ensure_ascii=False)),
+            )
+        return int(cur.lastrowid), session_id
+
+    def claim_job(self, owner: str, lease_s: int) -> Optional[sqlite3.Row]:
+        """
+        Lease the oldest runnable job (not finished, not leased, retry delay elapsed) to `owner`.
+        """
+        rows = self.conn.execute(
+            """UPDATE receipt_jobs
+               SET lease_owner=?, lease_until=datetime('now', ?), updated_at=datetime('now')
+               WHERE id = (
+                 SELECT id FROM receipt_jobs
+                 WHERE stage NOT IN ('DONE', 'FAILED')
+                   AND (lease_until IS NULL OR lease_until < datetime('now'))
+                   AND next_attempt_at <= datetime('now')
+                 ORDER BY id ASC LIMIT 1
+               )
+               RETURNING *""",
+            (owner, f"+{int(lease_s)} seconds"),
+        ).fetchall()  # drain RETURNING so the statement is finished before commit/release
+        self._commit()
+        return rows[0] if rows else None
+
+    def checkpoint_job(self, job_id: int, stage: str, lease_s: int, ocr_result: Optional[bytes] = None) -> None:
+        """
+        Record a finished stage (and renew the lease). ocr_result is kept so a retry skips OCR.
+        """
         self.conn.execute(
-            """INSERT INTO session_state (session_id, state_json)
-               VALUES (?, ?)
-               ON CONFLICT(session_id) DO UPDATE SET state_json=excluded.state_json, updated_at=datetime('now')""",
-            (session_id, payload),
+            """UPDATE receipt_jobs
+               SET stage=?, ocr_result=COALESCE(?, ocr_result), lease_until=datetime('now', ?), updated_at=datetime('now')
+               WHERE id=?""",
+            (stage, ocr_result, f"+{int(lease_s)} seconds", job_id),
         )
-        self.conn.commit()
+        self._commit()
+
+    def complete_job(self, job_id: int) -> None:
+        self.conn.execute(
+            """UPDATE receipt_jobs SET stage='DONE', ocr_result=NULL, lease_owner=NULL, lease_until=NULL,
+               updated_at=datetime('now') WHERE id=?""",
+            (job_id,),
+        )
+        self._commit()
+
+    def fail_job(self, job_id: int, error: str, max_attempts: int, backoff_base_s: float, permanent: bool = False) -> bool:
+        """
+        Count a failed attempt and schedule a retry with exponential backoff.
+        Returns True when the job gave up (session marked FAILED).
+        """
+        row = self.conn.execute("SELECT attempts, session_id FROM receipt_jobs WHERE id=?", (job_id,)).fetchone()
+        attempts = int(row["attempts"]) + 1
+        give_up = permanent or attempts >= max_attempts
+        delay = int(backoff_base_s * (2 ** (attempts - 1)))
+        with self._tx():
+            self.conn.execute(
+                """UPDATE receipt_jobs
+                   SET attempts=?, last_error=?, stage=CASE WHEN ? THEN 'FAILED' ELSE stage END,
+                       next_attempt_at=datetime('now', ?), lease_owner=NULL, lease_until=NULL, updated_at=datetime('now')
+                   WHERE id=?""",
+                (attempts, error[:1000], give_up, f"+{delay} seconds", job_id),
+            )
+            if give_up:
+                self.conn.execute(
+                    "UPDATE receipt_sessions SET status='FAILED', updated_at=datetime('now') WHERE id=?",
+                    (row["session_id"],),
+                )
+        return give_up
+
+    def release_job(self, job_id: int) -> None:
+        self.conn.execute(
+            "UPDATE receipt_jobs SET lease_owner=NULL, lease_until=NULL, updated_at=datetime('now') WHERE id=?",
+            (job_id,),
+        )
+        self._commit()
+
+    def release_job_leases(self) -> int:
+        """
+        Drop every lease; used at startup, when no job can still be running.
+        """
+        cur = self.conn.execute(
+            "UPDATE receipt_jobs SET lease_owner=NULL, lease_until=NULL WHERE lease_owner IS NOT NULL AND stage NOT IN ('DONE', 'FAILED')"
+        )
+        self._commit()
+        return cur.rowcount
+
+    def count_open_jobs(self) -> int:
+        return int(self.conn.execute("SELECT COUNT(*) FROM receipt_jobs WHERE stage NOT IN ('DONE', 'FAILED')").fetchone()[0])
+
+    # ---------- OCR cache ----------
+    def get_ocr_by_file_id(self, file_unique_id: str, engine_version: str) -> Optional[sqlite3.Row]:
+        return self.conn.execute(
+            "SELECT image_sha256, ocr_result FROM ocr_cache WHERE file_unique_id=? AND engine_version=? LIMIT 1",
+            (file_unique_id, engine_version),
+        ).fetchone()
+
+    def get_ocr_by_hash(self, image_sha256: str, engine_version: str) -> Optional[sqlite3.Row]:
+        return self.conn.execute(
+            "SELECT image_sha256, ocr_result FROM ocr_cache WHERE image_sha256=? AND engine_version=?",
+            (image_sha256, engine_version),
+        ).fetchone()
+
+    def put_ocr(self, image_sha256: str, file_unique_id: Optional[str], engine_version: str, ocr_result: bytes) -> int:
+        """
+        Insert or replace the result for an image. Returns how much the cache grew, in bytes.
+        """
+        old = self.conn.execute("SELECT size_bytes FROM ocr_cache WHERE image_sha256=?", (image_sha256,)).fetchone()
+        self.conn.execute(
+            """INSERT INTO ocr_cache (image_sha256, file_unique_id, engine_version, ocr_result, size_bytes)
+               VALUES (?, ?, ?, ?, ?)
+               ON CONFLICT(image_sha256) DO UPDATE SET
+                 file_unique_id=COALESCE(excluded.file_unique_id, file_unique_id),
+                 engine_version=excluded.engine_version, ocr_result=excluded.ocr_result,
+                 size_bytes=excluded.size_bytes, last_used_at=datetime('now')""",
+            (image_sha256, file_unique_id, engine_version, ocr_result, len(ocr_result)),
+        )
+        self._commit()
+        return len(ocr_result) - (old["size_bytes"] if old else 0)
+
+    def ocr_cache_bytes(self) -> int:
+        return int(self.conn.execute("SELECT COALESCE(SUM(size_bytes), 0) FROM ocr_cache").fetchone()[0])
+
+    def touch_ocr(self, image_sha256: str, file_unique_id: Optional[str] = None) -> None:
+        self.conn.execute(
+            """UPDATE ocr_cache SET last_used_at=datetime('now'), file_unique_id=COALESCE(?, file_unique_id)
+               WHERE image_sha256=?""",
+            (file_unique_id, image_sha256),
+        )
+        self._commit()
+
+    def evict_ocr(self, max_bytes: int) -> tuple[int, int]:
+        """
+        Delete least recently used entries until the cached results fit in max_bytes.
+        Returns (rows deleted, bytes left in the cache).
+        """
+        total = self.ocr_cache_bytes()
+        if total <= max_bytes:
+            return 0, total
+        doomed = []
+        for row in self.conn.execute("SELECT image_sha256, size_bytes FROM ocr_cache ORDER BY last_used_at ASC"):
+            if total <= max_bytes:
+                break
+            doomed.append((row["image_sha256"],))
+            total -= row["size_bytes"]
+        self.conn.executemany("DELETE FROM ocr_cache WHERE image_sha256=?", doomed)
+        self._commit()
+        return len(doomed), total
+
+    # ---------- ingested images ----------
+    def ingested_hashes(self, image_sha256s: Iterable[str]) -> set[str]:
+        hashes = list(image_sha256s)
+        found: set[str] = set()
+        for i in range(0, len(hashes), _IN_CHUNK):
+            chunk = hashes[i:i + _IN_CHUNK]
+            placeholders = ",".join("?" * len(chunk))
+            cur = self.conn.execute(f"SELECT image_sha256 FROM ingested_images WHERE image_sha256 IN ({placeholders})", chunk)
+            found.update(row["image_sha256"] for row in cur)
+        return found
+
+    def mark_ingested(self, image_sha256: str, session_id: int, source_path: Optional[str]) -> None:
+        self.conn.execute(
+            "INSERT OR REPLACE INTO ingested_images (image_sha256, session_id, source_path) VALUES (?, ?, ?)",
+            (image_sha256, session_id, source_path),
+        )
+        self._commit()
+
+    # ---------- image store ----------
+    def get_stored_image(self, image_sha256: str) -> Optional[sqlite3.Row]:
+        return self.conn.execute("SELECT * FROM stored_images WHERE image_sha256=?", (image_sha256,)).fetchone()
+
+    def put_stored_image(self, image_sha256: str, path: str, size_bytes: int) -> None:
+        self.conn.execute(
+            """INSERT INTO stored_images (image_sha256, path, size_bytes) VALUES (?, ?, ?)
+               ON CONFLICT(image_sha256) DO UPDATE SET path=excluded.path, size_bytes=excluded.size_bytes, archived=0""",
+            (image_sha256, path, size_bytes),
+        )
+        self._commit()
+
+    def mark_stored_image_archived(self, image_sha256: str, size_bytes: int) -> None:
+        self.conn.execute("UPDATE stored_images SET archived=1, size_bytes=? WHERE image_sha256=?", (size_bytes, image_sha256))
+        self._commit()
+
+    def stored_images_to_prune(self, max_age_days: int, max_bytes: int) -> list[sqlite3.Row]:
+        """
+        Images older than max_age_days, plus the oldest ones beyond max_bytes in total (0 = no limit).
+        """
+        cur = self.conn.execute(
+            """SELECT image_sha256, path, size_bytes FROM (
+                 SELECT image_sha256, path, size_bytes, created_at,
+                        SUM(size_bytes) OVER (ORDER BY created_at DESC, image_sha256 DESC) AS newer_bytes
+                 FROM stored_images
+               )
+               WHERE (? > 0 AND created_at < datetime('now', ?)) OR (? > 0 AND newer_bytes > ?)""",
+            (max_age_days, f"-{int(max_age_days)} days", max_bytes, max_bytes),
+        )
+        return list(cur.fetchall())
+
+    def delete_stored_images(self, image_sha256s: Iterable[str]) -> None:
+        shas = list(image_sha256s)
+        with self._tx():
+            for i in range(0, len(shas), _IN_CHUNK):
+                chunk = shas[i:i + _IN_CHUNK]
+                marks = ",".join("?" * len(chunk))
+                self.conn.execute(
+                    f"""UPDATE receipt_sessions SET image_path=NULL
+                        WHERE image_path IN (SELECT path FROM stored_images WHERE image_sha256 IN ({marks}))""",
+                    chunk,
+                )
+                self.conn.execute(f"DELETE FROM stored_images WHERE image_sha256 IN ({marks})", chunk)
+
+    # ---------- pipeline timings ----------
+    def add_timings(self, session_id: int, stages: Iterable[tuple[str, float]]) -> None:
+        self.conn.executemany(
+            "INSERT INTO pipeline_timings (session_id, stage, seconds) VALUES (?, ?, ?)",
+            [(session_id, stage, seconds) for stage, seconds in stages],
+        )
+        self._commit()
+
+    # ---------- session state ----------
+    def set_state(self, session_id: int, state: dict[str, Any]) -> None:
+        self.write_states([(session_id, json.dumps(state, separators=(",", ":"), ensure_ascii=False))], ())
+        self._commit()
+
+    def write_states(self, puts: Iterable[tuple[int, str]], deletes: Iterable[int]) -> None:
+        """
+        Upsert already-encoded states and delete others, in one transaction.
+        """
+        with self._tx():
+            self.conn.executemany(
+                """INSERT INTO session_state (session_id, state_json)
+                   VALUES (?, ?)
+                   ON CONFLICT(session_id) DO UPDATE SET state_json=excluded.state_json, updated_at=datetime('now')""",
+                puts,
+            )
+            self.conn.executemany("DELETE FROM session_state WHERE session_id=?", ((sid,) for sid in deletes))
 
     def get_state(self, session_id: int) -> dict[str, Any]:
         row = self.conn.execute("SELECT state_json FROM session_state WHERE session_id=?", (session_id,)).fetchone()
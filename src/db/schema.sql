@@ -1,3 +1,6 @@
+-- Version 1 of the schema (the baseline migration). Later changes are appended to
+-- MIGRATIONS in src/db/migrations.py instead of being edited in here.
+
 PRAGMA foreign_keys = ON;
 
 -- User table (even if single-user, it helps keep things clean)
@@ -29,7 +32,8 @@ CREATE TABLE IF NOT EXISTS receipt_sessions (
   account         TEXT NOT NULL,
   store           TEXT,               -- 'WALMART' | 'SAMS' | NULL
   receipt_date    TEXT NOT NULL,      -- mm/dd/yyyy (today)
-  status          TEXT NOT NULL,      -- 'PROCESSING' | 'AWAITING_USER' | 'DONE'
+  status          TEXT NOT NULL,      -- 'PROCESSING' | 'AWAITING_USER' | 'DONE' | 'FAILED'
+  unresolved_count INTEGER NOT NULL DEFAULT 0,  -- lines without a mapping, kept up to date by Repo
   image_path      TEXT,               -- local path (optional)
   created_at      TEXT NOT NULL DEFAULT (datetime('now')),
   updated_at      TEXT NOT NULL DEFAULT (datetime('now')),
@@ -59,6 +63,86 @@ CREATE TABLE IF NOT EXISTS session_state (
   FOREIGN KEY(session_id) REFERENCES receipt_sessions(id) ON DELETE CASCADE
 );
 
+-- Durable processing job per receipt session (survives restarts)
+CREATE TABLE IF NOT EXISTS receipt_jobs (
+  id              INTEGER PRIMARY KEY AUTOINCREMENT,
+  session_id      INTEGER NOT NULL UNIQUE,
+  user_id         INTEGER NOT NULL,
+  chat_id         INTEGER NOT NULL,   -- where to reply
+  message_id      INTEGER NOT NULL,
+  payload_json    TEXT NOT NULL,      -- photos (file_id/file_unique_id), account
+  stage           TEXT NOT NULL DEFAULT 'QUEUED',  -- 'QUEUED' | 'OCR_DONE' | 'MAPPED' | 'DONE' | 'FAILED'
+  ocr_result      BLOB,               -- checkpoint: OCRResult.to_bytes() once OCR finished
+  attempts        INTEGER NOT NULL DEFAULT 0,
+  last_error      TEXT,
+  next_attempt_at TEXT NOT NULL DEFAULT (datetime('now')),
+  lease_owner     TEXT,
+  lease_until     TEXT,
+  created_at      TEXT NOT NULL DEFAULT (datetime('now')),
+  updated_at      TEXT NOT NULL DEFAULT (datetime('now')),
+  FOREIGN KEY(session_id) REFERENCES receipt_sessions(id) ON DELETE CASCADE,
+  FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE
+);
+
+-- OCR results by image content, so re-sent receipts skip download/OCR
+CREATE TABLE IF NOT EXISTS ocr_cache (
+  image_sha256    TEXT PRIMARY KEY,
+  file_unique_id  TEXT,               -- Telegram file_unique_id (stable across bots/chats)
+  engine_version  TEXT NOT NULL,
+  ocr_result      BLOB NOT NULL,      -- OCRResult.to_bytes()
+  size_bytes      INTEGER NOT NULL,
+  created_at      TEXT NOT NULL DEFAULT (datetime('now')),
+  last_used_at    TEXT NOT NULL DEFAULT (datetime('now'))
+);
+
+-- Images already turned into sessions (lets bulk ingestion resume and skip duplicates)
+CREATE TABLE IF NOT EXISTS ingested_images (
+  image_sha256    TEXT PRIMARY KEY,
+  session_id      INTEGER NOT NULL,
+  source_path     TEXT,
+  created_at      TEXT NOT NULL DEFAULT (datetime('now')),
+  FOREIGN KEY(session_id) REFERENCES receipt_sessions(id) ON DELETE CASCADE
+);
+
+-- Per-stage processing times of each receipt (seconds)
+CREATE TABLE IF NOT EXISTS pipeline_timings (
+  id              INTEGER PRIMARY KEY AUTOINCREMENT,
+  session_id      INTEGER NOT NULL,
+  stage           TEXT NOT NULL,
+  seconds         REAL NOT NULL,
+  created_at      TEXT NOT NULL DEFAULT (datetime('now')),
+  FOREIGN KEY(session_id) REFERENCES receipt_sessions(id) ON DELETE CASCADE
+);
+
+-- Receipt photos kept by the image store, one file per content hash
+CREATE TABLE IF NOT EXISTS stored_images (
+  image_sha256    TEXT PRIMARY KEY,
+  path            TEXT NOT NULL,
+  size_bytes      INTEGER NOT NULL,
+  archived        INTEGER NOT NULL DEFAULT 0,   -- re-encoded after processing
+  created_at      TEXT NOT NULL DEFAULT (datetime('now'))
+);
+
+-- Spending per (user, month, category, subcategory) over mapped lines, kept up to date by Repo
+CREATE TABLE IF NOT EXISTS spending_summary (
+  user_id         INTEGER NOT NULL,
+  month           TEXT NOT NULL,      -- yyyy-mm of receipt_date
+  category        TEXT NOT NULL,
+  subcategory     TEXT NOT NULL,
+  total           REAL NOT NULL DEFAULT 0.0,
+  line_count      INTEGER NOT NULL DEFAULT 0,
+  PRIMARY KEY (user_id, month, category, subcategory),
+  FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE
+) WITHOUT ROWID;
+
 -- Helpful indexes
 CREATE INDEX IF NOT EXISTS idx_receipt_lines_session ON receipt_lines(session_id);
+CREATE INDEX IF NOT EXISTS idx_receipt_lines_unresolved_key ON receipt_lines(normalized_key) WHERE mapping_id IS NULL;
+CREATE INDEX IF NOT EXISTS idx_receipt_lines_mapping ON receipt_lines(mapping_id);
 CREATE INDEX IF NOT EXISTS idx_item_mappings_user_key ON item_mappings(user_id, normalized_key);
+CREATE INDEX IF NOT EXISTS idx_receipt_sessions_user_status ON receipt_sessions(user_id, status);
+CREATE INDEX IF NOT EXISTS idx_ocr_cache_file_unique_id ON ocr_cache(file_unique_id);
+CREATE INDEX IF NOT EXISTS idx_ocr_cache_last_used ON ocr_cache(last_used_at);
+CREATE INDEX IF NOT EXISTS idx_pipeline_timings_session ON pipeline_timings(session_id);
+CREATE INDEX IF NOT EXISTS idx_stored_images_created ON stored_images(created_at);
+CREATE INDEX IF NOT EXISTS idx_receipt_jobs_open ON receipt_jobs(stage, next_attempt_at);
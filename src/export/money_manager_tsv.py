@@ -1,5 +1,7 @@
+import gzip
 from dataclasses import dataclass
 from datetime import datetime
+from typing import BinaryIO, Iterable, Iterator
 
 
 @dataclass
@@ -18,11 +20,32 @@ def today_mmddyyyy() -> str:
     return datetime.now().strftime("%m/%d/%Y")
 
 
-def to_tsv(rows: list[TSVRow]) -> str:
-    header = "Date\tAccount\tCategory\tSubcategory\tNote\tAmount\tIncome/Expense\tDescription"
-    lines = [header]
+HEADER = "Date\tAccount\tCategory\tSubcategory\tNote\tAmount\tIncome/Expense\tDescription"
+
+
+def iter_tsv_lines(rows: Iterable[TSVRow]) -> Iterator[str]:
+    """
+    Yield the TSV one line at a time (header first, each line ends with a newline).
+    """
+    yield HEADER + "\n"
     for r in rows:
-        lines.append(
-            f"{r.date}\t{r.account}\t{r.category}\t{r.subcategory}\t{r.note}\t{r.amount}\t{r.income_expense}\t{r.description}"
-        )
-    return "\n".join(lines) + "\n"
+        yield f"{r.date}\t{r.account}\t{r.category}\t{r.subcategory}\t{r.note}\t{r.amount}\t{r.income_expense}\t{r.description}\n"
+
+
+def write_tsv(rows: Iterable[TSVRow], out: BinaryIO, compress: bool = False) -> int:
+    """
+    Stream rows into a binary file object (open(..., "wb"), BytesIO). Returns the number of data rows.
+    compress=True writes it gzipped (out itself is left open).
+    """
+    if compress:
+        # mtime=0: the same rows always give the same bytes
+        with gzip.GzipFile(fileobj=out, mode="wb", mtime=0) as gz:
+            return write_tsv(rows, gz)
+    count = -1
+    for count, line in enumerate(iter_tsv_lines(rows)):
+        out.write(line.encode("utf-8"))
+    return count
+
+
+def to_tsv(rows: Iterable[TSVRow]) -> str:
+    return "".join(iter_tsv_lines(rows))
@@ -1,29 +1,73 @@
-from pathlib import Path
-from src.config import load_config
+import logging
+import secrets
+from typing import TYPE_CHECKING
+from urllib.parse import urlparse
+
+from src.config import Config, load_config
 from src.log import setup_logging
-from src.db.db import connect, init_db
-from src.bot.telegram_bot import build_app
+from src.db.db import Database, Pragmas, connect, init_db
+from src.metrics import metrics
+
+if TYPE_CHECKING:
+    from telegram.ext import Application
+
+log = logging.getLogger(__name__)
+
+
+def run(app: "Application", cfg: Config) -> None:
+    from src.bot.telegram_bot import allowed_updates
+
+    updates = allowed_updates(app)
+    tg = cfg.telegram
+    if tg.mode == "polling":
+        app.run_polling(allowed_updates=updates)
+    elif tg.mode == "webhook":
+        if not tg.webhook_url:
+            raise ValueError("telegram.webhook_url is required in webhook mode")
+        app.run_webhook(
+            listen=tg.webhook_listen,
+            port=tg.webhook_port,
+            url_path=urlparse(tg.webhook_url).path.lstrip("/"),
+            webhook_url=tg.webhook_url,
+            # setWebhook runs on every start, so a fresh secret per run is fine
+            secret_token=tg.webhook_secret or secrets.token_urlsafe(32),
+            allowed_updates=updates,
+        )
+    else:
+        raise ValueError(f"unknown telegram.mode: {tg.mode!r}")
 
 
 def main() -> None:
     setup_logging()
-    cfg = load_config("config.yaml")
-
-    cfg.app.data_dir.mkdir(parents=True, exist_ok=True)
-    cfg.app.downloads_dir.mkdir(parents=True, exist_ok=True)
+    with metrics.trace() as startup:
+        with metrics.span("startup.config"):
+            cfg = load_config("config.yaml")
+            cfg.app.data_dir.mkdir(parents=True, exist_ok=True)
+            cfg.app.downloads_dir.mkdir(parents=True, exist_ok=True)
 
-    conn = connect(cfg.app.db_path)
+        with metrics.span("startup.db"):
+            pragmas = Pragmas(
+                synchronous=cfg.db.synchronous,
+                mmap_size=cfg.db.mmap_size_mb * 1024 * 1024,
+                cache_size_kb=cfg.db.cache_size_mb * 1024,
+            )
+            conn = connect(cfg.app.db_path, pragmas)
+            init_db(conn)
+            conn.close()
+            db = Database(cfg.app.db_path, readers=cfg.db.readers, batch_max=cfg.db.write_batch_max, pragmas=pragmas)
 
-    schema_path = Path(__file__).parent / "db" / "schema.sql"
-    schema_sql = schema_path.read_text(encoding="utf-8")
-    init_db(conn, schema_sql)
+        with metrics.span("startup.imports"):
+            # the telegram stack is most of the startup time; tools that only need the DB never load it
+            from src.bot.telegram_bot import build_app
 
-    from src.db.repo import Repo
-    repo = Repo(conn)
+        with metrics.span("startup.build"):
+            app = build_app(cfg, db)
 
-    app = build_app(cfg.telegram.bot_token, repo, cfg.app.downloads_dir)
-    app.run_polling(allowed_updates=[])
-    # NOTE: allowed_updates=[] means "all"; you can tighten later.
+    log.info("startup: %s", ", ".join(f"{stage.split('.', 1)[1]} {seconds * 1000:.0f}ms" for stage, seconds in startup.stages))
+    try:
+        run(app, cfg)
+    finally:
+        db.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,123 @@
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable, Iterable, Optional
+
+from src.db.repo import Repo
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    loads: int = 0
+    evictions: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+class MappingCache:
+    """
+    Per-user in-memory copy of item_mappings ({normalized_key: mapping_id}).
+
+    - A user's mappings are loaded in one query the first time they are needed.
+    - upsert_mapping writes to the DB first, then updates the cached copy.
+    - Total cached entries are capped; least recently used users are evicted first.
+    """
+
+    def __init__(self, repo: Repo, max_entries: int = 50_000):
+        self.repo = repo
+        self.max_entries = max_entries
+        self.stats = CacheStats()
+        self._users: "OrderedDict[int, dict[str, int]]" = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self._listeners: list[Callable[[int, str, int], None]] = []
+
+    def add_listener(self, fn: Callable[[int, str, int], None]) -> None:
+        """
+        fn(user_id, normalized_key, mapping_id) is called after every upsert_mapping.
+        """
+        self._listeners.append(fn)
+
+    def get(self, user_id: int, normalized_key: str) -> Optional[int]:
+        return self.resolve(user_id, [normalized_key]).get(normalized_key)
+
+    def resolve(self, user_id: int, normalized_keys: Iterable[str]) -> dict[str, int]:
+        """
+        {normalized_key: mapping_id} for the keys that have a mapping; unknown keys are left out.
+        """
+        with self._lock:
+            user_map = self._user_map(user_id)
+            found: dict[str, int] = {}
+            for nk in normalized_keys:
+                mapping_id = user_map.get(nk)
+                if mapping_id is None:
+                    self.stats.misses += 1
+                else:
+                    self.stats.hits += 1
+                    found[nk] = mapping_id
+            return found
+
+    def upsert_mapping(self, user_id: int, normalized_key: str, canonical_name: str, category: str, subcategory: str) -> int:
+        mapping_id = self.repo.upsert_mapping(user_id, normalized_key, canonical_name, category, subcategory)
+        self.add_mappings(user_id, {normalized_key: mapping_id})
+        return mapping_id
+
+    def add_mappings(self, user_id: int, mapping_ids: dict[str, int]) -> None:
+        """
+        Record mappings that were already written to the DB (e.g. by Repo.resolve_lines).
+        """
+        with self._lock:
+            user_map = self._users.get(user_id)
+            # not loaded yet -> the next lazy load will pick them up from the DB
+            if user_map is not None:
+                for nk, mapping_id in mapping_ids.items():
+                    if nk not in user_map:
+                        self._size += 1
+                    user_map[nk] = mapping_id
+                self._evict(keep=user_id)
+        for nk, mapping_id in mapping_ids.items():
+            for fn in self._listeners:
+                fn(user_id, nk, mapping_id)
+
+    def snapshot(self, user_id: int) -> dict[str, int]:
+        """
+        Copy of all of the user's mappings (loads them if needed).
+        """
+        with self._lock:
+            return dict(self._user_map(user_id))
+
+    def invalidate(self, user_id: Optional[int] = None) -> None:
+        with self._lock:
+            if user_id is None:
+                self._users.clear()
+                self._size = 0
+            elif user_id in self._users:
+                self._size -= len(self._users.pop(user_id))
+
+    # ---------- internals (call with lock held) ----------
+    def _user_map(self, user_id: int) -> dict[str, int]:
+        user_map = self._users.get(user_id)
+        if user_map is not None:
+            self._users.move_to_end(user_id)
+            return user_map
+
+        user_map = self.repo.load_mappings(user_id)
+        self.stats.loads += 1
+        self._users[user_id] = user_map
+        self._size += len(user_map)
+        self._evict(keep=user_id)
+        return user_map
+
+    def _evict(self, keep: int) -> None:
+        while self._size > self.max_entries and len(self._users) > 1:
+            oldest = next(iter(self._users))
+            if oldest == keep:
+                self._users.move_to_end(keep)
+                continue
+            self._size -= len(self._users.pop(oldest))
+            self.stats.evictions += 1
@@ -0,0 +1,98 @@
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional
+
+from src.mapping.cache import MappingCache
+
+
+@dataclass(frozen=True)
+class Suggestion:
+    normalized_key: str
+    mapping_id: int
+    score: float     # Dice coefficient over trigrams, 0..1
+
+
+def trigrams(key: str) -> frozenset[str]:
+    padded = f"  {key} "
+    return frozenset(padded[i:i + 3] for i in range(len(padded) - 2))
+
+
+class _UserIndex:
+    __slots__ = ("postings", "grams", "ids")
+
+    def __init__(self) -> None:
+        self.postings: dict[str, set[str]] = {}     # trigram -> keys containing it
+        self.grams: dict[str, frozenset[str]] = {}  # key -> its trigrams
+        self.ids: dict[str, int] = {}               # key -> mapping_id
+
+    def add(self, key: str, mapping_id: int) -> None:
+        self.ids[key] = mapping_id
+        if key in self.grams:
+            return
+        grams = trigrams(key)
+        self.grams[key] = grams
+        for g in grams:
+            self.postings.setdefault(g, set()).add(key)
+
+
+class FuzzyIndex:
+    """
+    In-process trigram inverted index over each user's mapped normalized keys.
+
+    Built lazily per user from the MappingCache and kept current through its upsert hook.
+    Used to suggest mappings for keys that miss exactly ("gv mlk 2pct" -> "gv milk 2pct").
+    """
+
+    def __init__(self, mappings: MappingCache, max_users: int = 16):
+        self.mappings = mappings
+        self.max_users = max_users
+        self._users: "OrderedDict[int, _UserIndex]" = OrderedDict()
+        self._lock = threading.Lock()
+        mappings.add_listener(self._on_upsert)
+
+    def suggest(self, user_id: int, normalized_key: str, k: int = 5, min_score: float = 0.3) -> list[Suggestion]:
+        """
+        Top-k known keys by trigram similarity, best first.
+        """
+        query = trigrams(normalized_key)
+        if not query:
+            return []
+        with self._lock:
+            idx = self._index(user_id)
+            overlap: dict[str, int] = {}
+            for g in query:
+                for key in idx.postings.get(g, ()):
+                    overlap[key] = overlap.get(key, 0) + 1
+
+            scored = []
+            n_query = len(query)
+            for key, common in overlap.items():
+                score = 2.0 * common / (n_query + len(idx.grams[key]))
+                if score >= min_score:
+                    scored.append(Suggestion(key, idx.ids[key], round(score, 4)))
+        scored.sort(key=lambda s: (-s.score, s.normalized_key))
+        return scored[:k]
+
+    def best(self, user_id: int, normalized_key: str, threshold: float) -> Optional[Suggestion]:
+        top = self.suggest(user_id, normalized_key, k=1, min_score=threshold)
+        return top[0] if top else None
+
+    def _index(self, user_id: int) -> _UserIndex:
+        idx = self._users.get(user_id)
+        if idx is not None:
+            self._users.move_to_end(user_id)
+            return idx
+        idx = _UserIndex()
+        for key, mapping_id in self.mappings.snapshot(user_id).items():
+            idx.add(key, mapping_id)
+        self._users[user_id] = idx
+        while len(self._users) > self.max_users:
+            self._users.popitem(last=False)
+        return idx
+
+    def _on_upsert(self, user_id: int, normalized_key: str, mapping_id: int) -> None:
+        with self._lock:
+            idx = self._users.get(user_id)
+            if idx is not None:
+                idx.add(normalized_key, mapping_id)
@@ -1,10 +1,34 @@
-from typing import Optional
-from src.db.repo import Repo
+from typing import Iterable, Optional
+from src.mapping.cache import MappingCache
+from src.mapping.fuzzy import FuzzyIndex
 
 
-def map_or_mark_unknown(repo: Repo, user_id: int, normalized_key: str) -> Optional[int]:
+def map_or_mark_unknown(mappings: MappingCache, user_id: int, normalized_key: str) -> Optional[int]:
     """
     Return mapping_id if found else None.
     """
-    row = repo.find_mapping(user_id, normalized_key)
-    return int(row["id"]) if row else None
+    return mappings.get(user_id, normalized_key)
+
+
+def map_keys(
+    mappings: MappingCache,
+    user_id: int,
+    normalized_keys: Iterable[str],
+    fuzzy: Optional[FuzzyIndex] = None,
+    auto_apply_threshold: float = 0.0,
+) -> dict[str, int]:
+    """
+    Resolve a whole receipt at once: {normalized_key: mapping_id} for the known keys.
+
+    With a fuzzy index and a threshold > 0, keys that miss exactly take the best
+    near-duplicate mapping scoring at least the threshold.
+    """
+    keys = list(normalized_keys)
+    found = mappings.resolve(user_id, keys)
+    if fuzzy is not None and auto_apply_threshold > 0:
+        for nk in keys:
+            if nk not in found:
+                best = fuzzy.best(user_id, nk, auto_apply_threshold)
+                if best is not None:
+                    found[nk] = best.mapping_id
+    return found
@@ -0,0 +1,156 @@
+import bisect
+import functools
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Iterator, Optional, TypeVar
+
+log = logging.getLogger(__name__)
+
+F = TypeVar("F", bound=Callable)
+
+# Prometheus-style upper bounds in seconds (+Inf implied)
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class Histogram:
+    """
+    Cumulative buckets for export plus a window of recent samples for percentiles.
+    """
+
+    def __init__(self, window: int = 1024):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.recent: deque[float] = deque(maxlen=window)
+
+    def observe(self, seconds: float) -> None:
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        self.recent.append(seconds)
+
+    def percentile(self, q: float) -> float:
+        if not self.recent:
+            return 0.0
+        ordered = sorted(self.recent)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class Trace:
+    """
+    Stage timings of one receipt, collected so they can be stored with its session.
+    """
+
+    def __init__(self) -> None:
+        self.session_id: Optional[int] = None
+        self.stages: list[tuple[str, float]] = []
+
+
+_current_trace: ContextVar[Optional[Trace]] = ContextVar("current_trace", default=None)
+
+
+class Metrics:
+    def __init__(self) -> None:
+        self._hist: dict[str, Histogram] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            hist = self._hist.get(stage)
+            if hist is None:
+                hist = self._hist[stage] = Histogram()
+            hist.observe(seconds)
+        tr = _current_trace.get()
+        if tr is not None:
+            tr.stages.append((stage, seconds))
+
+    @contextmanager
+    def span(self, stage: str) -> Iterator[None]:
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - t0)
+
+    def timed(self, stage: str) -> Callable[[F], F]:
+        def deco(fn: F) -> F:
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                with self.span(stage):
+                    return fn(*args, **kwargs)
+            return wrapper  # type: ignore[return-value]
+        return deco
+
+    @contextmanager
+    def trace(self) -> Iterator[Trace]:
+        """
+        Collect every span recorded in this context (and in contexts copied from it) into a Trace.
+        """
+        tr = Trace()
+        token = _current_trace.set(tr)
+        try:
+            yield tr
+        finally:
+            _current_trace.reset(token)
+
+    def summary(self) -> dict[str, dict[str, float]]:
+        """
+        {stage: {count, p50, p95, avg}} with times in seconds.
+        """
+        with self._lock:
+            return {
+                stage: {
+                    "count": h.count,
+                    "p50": h.percentile(0.50),
+                    "p95": h.percentile(0.95),
+                    "avg": h.sum / h.count if h.count else 0.0,
+                }
+                for stage, h in sorted(self._hist.items())
+            }
+
+    def prometheus_text(self, prefix: str = "receipt_stage_seconds") -> str:
+        out = [f"# HELP {prefix} Time spent per pipeline stage.", f"# TYPE {prefix} histogram"]
+        with self._lock:
+            for stage, h in sorted(self._hist.items()):
+                cumulative = 0
+                for bound, n in zip(BUCKETS + (float("inf"),), h.counts):
+                    cumulative += n
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    out.append(f'{prefix}_bucket{{stage="{stage}",le="{le}"}} {cumulative}')
+                out.append(f'{prefix}_sum{{stage="{stage}"}} {h.sum}')
+                out.append(f'{prefix}_count{{stage="{stage}"}} {h.count}')
+        return "\n".join(out) + "\n"
+
+
+metrics = Metrics()
+
+
+def serve_prometheus(port: int, host: str = "127.0.0.1", registry: Metrics = metrics) -> ThreadingHTTPServer:
+    """
+    Serve GET /metrics in Prometheus text format from a daemon thread. Call .shutdown() to stop.
+    """
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self) -> None:
+            if self.path.split("?", 1)[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = registry.prometheus_text().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, fmt: str, *args) -> None:
+            log.debug("metrics: " + fmt, *args)
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    log.info("metrics on http://%s:%s/metrics", host, port)
+    return server
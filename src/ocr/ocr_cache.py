@@ -0,0 +1,76 @@
+import hashlib
+import threading
+from dataclasses import dataclass
+from typing import Optional
+
+from src.db.repo import Repo
+from src.ocr.ocr_result import OCRResult
+
+
+@dataclass
+class OCRCacheStats:
+    file_id_hits: int = 0     # skipped download and OCR
+    hash_hits: int = 0        # downloaded, skipped OCR
+    misses: int = 0
+    stores: int = 0
+    evicted: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.file_id_hits + self.hash_hits + self.misses
+        return (self.file_id_hits + self.hash_hits) / total if total else 0.0
+
+
+def image_sha256(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+class OCRCache:
+    """
+    Structured OCR results stored in the ocr_cache table, keyed by image SHA-256 and Telegram file_unique_id.
+
+    Entries produced by another engine_version are ignored. When the stored results exceed
+    max_bytes, least recently used entries are deleted until they are back under 90% of it,
+    so a full cache doesn't evict on every store.
+    """
+
+    def __init__(self, repo: Repo, engine_version: str, max_bytes: int = 50 * 1024 * 1024):
+        self.repo = repo
+        self.engine_version = engine_version
+        self.max_bytes = max_bytes
+        self.stats = OCRCacheStats()
+        self._lock = threading.Lock()
+        self._total_bytes: Optional[int] = None   # running size of the table, summed once on the first store
+
+    def lookup_file(self, file_unique_id: str) -> Optional[OCRResult]:
+        """
+        Check by Telegram file_unique_id before downloading. A miss here is not counted yet;
+        the caller follows up with lookup_image once it has the bytes.
+        """
+        row = self.repo.get_ocr_by_file_id(file_unique_id, self.engine_version)
+        if row is None:
+            return None
+        self.stats.file_id_hits += 1
+        self.repo.touch_ocr(row["image_sha256"])
+        return OCRResult.from_bytes(row["ocr_result"])
+
+    def lookup_image(self, sha256: str, file_unique_id: Optional[str] = None) -> Optional[OCRResult]:
+        row = self.repo.get_ocr_by_hash(sha256, self.engine_version)
+        if row is None:
+            self.stats.misses += 1
+            return None
+        self.stats.hash_hits += 1
+        # same image under a new file_unique_id (e.g. re-uploaded from the gallery)
+        self.repo.touch_ocr(sha256, file_unique_id)
+        return OCRResult.from_bytes(row["ocr_result"])
+
+    def store(self, sha256: str, file_unique_id: Optional[str], result: OCRResult) -> None:
+        with self._lock:
+            if self._total_bytes is None:
+                self._total_bytes = self.repo.ocr_cache_bytes()
+            self._total_bytes += self.repo.put_ocr(sha256, file_unique_id, self.engine_version, result.to_bytes())
+            self.stats.stores += 1
+            if self._total_bytes > self.max_bytes:
+                # evict_ocr sums the table itself, correcting any drift (e.g. a store rolled back by ingest_dir)
+                evicted, self._total_bytes = self.repo.evict_ocr(int(self.max_bytes * 0.9))
+                self.stats.evicted += evicted
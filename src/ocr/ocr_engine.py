@@ -1,17 +1,32 @@
 from pathlib import Path
+from typing import Union
+
+from src.ocr.ocr_result import OCRResult
+
+# A file on disk or the encoded image bytes (as downloaded / after preprocessing)
+ImageInput = Union[Path, bytes]
 
 
 class OCREngine:
+    # Bump when OCR output changes (backend, settings); cached results from other versions are ignored.
+    VERSION = "placeholder-0"
+
     def __init__(self) -> None:
         # TODO: init local OCR (e.g., tesseract wrapper) or API client
         pass
 
-    def extract_text(self, image_path: Path) -> str:
+    def extract(self, image: ImageInput) -> OCRResult:
         """
-        Return raw OCR text for the receipt.
+        Return structured OCR output: lines with boxes and per-token confidences.
 
         Placeholder:
         - Implement local OCR or API OCR
-        - Consider returning structured blocks later (lines + coordinates)
+        - Engines that only produce text can return OCRResult.from_text(text)
         """
         raise NotImplementedError("Implement OCR here")
+
+    def extract_text(self, image: ImageInput) -> str:
+        """
+        Return raw OCR text for the receipt.
+        """
+        return self.extract(image).text
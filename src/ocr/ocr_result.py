@@ -0,0 +1,130 @@
+import struct
+import sys
+from array import array
+from typing import Iterable, Iterator, Optional, Sequence
+
+Box = tuple[int, int, int, int]   # left, top, right, bottom in image pixels
+
+_NO_BOX: Box = (0, 0, 0, 0)
+_FORMAT_VERSION = 1
+_HEADER = struct.Struct("<BI")          # version, line count
+_LINE = struct.Struct("<4iHI")          # box, token count, utf-8 text length
+
+
+class OCRLine:
+    """
+    One text line. token_confidences lines up with text.split(); an empty array means the
+    engine gave no confidences.
+    """
+
+    __slots__ = ("text", "box", "token_confidences")
+
+    def __init__(self, text: str, box: Box = _NO_BOX, token_confidences: Optional[Sequence[float]] = None):
+        self.text = text
+        self.box = box
+        self.token_confidences = array("f", token_confidences or ())
+
+    @property
+    def confidence(self) -> Optional[float]:
+        """
+        Weakest token of the line (one bad digit spoils a price), None if unknown.
+        """
+        return round(min(self.token_confidences), 4) if self.token_confidences else None
+
+    def __repr__(self) -> str:
+        return f"OCRLine({self.text!r}, box={self.box}, confidence={self.confidence})"
+
+    def __eq__(self, other: object) -> bool:
+        return (
+            isinstance(other, OCRLine)
+            and self.text == other.text
+            and self.box == other.box
+            and self.token_confidences == other.token_confidences
+        )
+
+
+class OCRResult:
+    """
+    Structured OCR output: lines in reading order with boxes and per-token confidences.
+
+    `text` is the plain-text view older callers used. to_bytes()/from_bytes() is a compact
+    little-endian encoding used for the ocr_cache table.
+    """
+
+    __slots__ = ("lines", "_text")
+
+    def __init__(self, lines: Iterable[OCRLine] = ()):
+        self.lines: list[OCRLine] = list(lines)
+        self._text: Optional[str] = None
+
+    @classmethod
+    def from_text(cls, text: str) -> "OCRResult":
+        """
+        Wrap plain text from an engine that has no layout/confidence information.
+        """
+        return cls(OCRLine(line) for line in text.splitlines())
+
+    @property
+    def text(self) -> str:
+        if self._text is None:
+            self._text = "\n".join(line.text for line in self.lines)
+        return self._text
+
+    def __iter__(self) -> Iterator[OCRLine]:
+        return iter(self.lines)
+
+    def __len__(self) -> int:
+        return len(self.lines)
+
+    def __eq__(self, other: object) -> bool:
+        return isinstance(other, OCRResult) and self.lines == other.lines
+
+    def __getstate__(self):
+        return self.to_bytes()
+
+    def __setstate__(self, state: bytes) -> None:
+        self.lines = OCRResult.from_bytes(state).lines
+        self._text = None
+
+    # ---------- serialization ----------
+    def to_bytes(self) -> bytes:
+        parts = [_HEADER.pack(_FORMAT_VERSION, len(self.lines))]
+        for line in self.lines:
+            encoded = line.text.encode("utf-8")
+            parts.append(_LINE.pack(*line.box, len(line.token_confidences), len(encoded)))
+            parts.append(_le(line.token_confidences).tobytes())
+            parts.append(encoded)
+        return b"".join(parts)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "OCRResult":
+        version, count = _HEADER.unpack_from(data, 0)
+        if version != _FORMAT_VERSION:
+            raise ValueError(f"unsupported OCRResult format: {version}")
+        offset = _HEADER.size
+        lines = []
+        for _ in range(count):
+            left, top, right, bottom, n_tokens, n_text = _LINE.unpack_from(data, offset)
+            offset += _LINE.size
+            confidences = array("f")
+            confidences.frombytes(data[offset:offset + 4 * n_tokens])
+            confidences = _le(confidences)
+            offset += 4 * n_tokens
+            text = data[offset:offset + n_text].decode("utf-8")
+            offset += n_text
+
+            line = OCRLine(text, (left, top, right, bottom))
+            line.token_confidences = confidences
+            lines.append(line)
+        return cls(lines)
+
+
+def _le(values: array) -> array:
+    """
+    Confidences are stored little-endian; swap on big-endian hosts (the swap is its own inverse).
+    """
+    if sys.byteorder == "little":
+        return values
+    swapped = array("f", values)
+    swapped.byteswap()
+    return swapped
@@ -0,0 +1,52 @@
+import re
+from difflib import SequenceMatcher
+
+from src.ocr.ocr_result import OCRLine, OCRResult
+
+_WS_RE = re.compile(r"\s+")
+
+
+def _norm(text: str) -> str:
+    return _WS_RE.sub(" ", text).strip().upper()
+
+
+def _same_line(a: str, b: str, min_ratio: float) -> bool:
+    if a == b:
+        return True
+    if not a or not b:
+        return False
+    return SequenceMatcher(None, a, b, autojunk=False).ratio() >= min_ratio
+
+
+def _overlap(prev: list[str], nxt: list[str], max_overlap: int, min_ratio: float) -> int:
+    """
+    Largest k such that the last k lines of prev match the first k lines of nxt.
+    """
+    for k in range(min(len(prev), len(nxt), max_overlap), 0, -1):
+        if all(_same_line(a, b, min_ratio) for a, b in zip(prev[-k:], nxt[:k])):
+            return k
+    return 0
+
+
+def stitch(parts: list[OCRResult], max_overlap: int = 15, min_ratio: float = 0.9) -> OCRResult:
+    """
+    Join the OCR results of a receipt photographed in several parts (top to bottom).
+
+    Lines repeated where consecutive photos overlap are dropped (compared after whitespace/case
+    normalization, tolerating small OCR differences), and boxes are shifted down so the result
+    reads like one tall image.
+    """
+    lines: list[OCRLine] = []
+    norms: list[str] = []
+    y_offset = 0
+    for part in parts:
+        part_norms = [_norm(line.text) for line in part.lines]
+        skip = _overlap(norms, part_norms, max_overlap, min_ratio) if lines else 0
+        for line, norm in zip(part.lines[skip:], part_norms[skip:]):
+            left, top, right, bottom = line.box
+            shifted = OCRLine(line.text, (left, top + y_offset, right, bottom + y_offset) if right or bottom else line.box)
+            shifted.token_confidences = line.token_confidences
+            lines.append(shifted)
+            norms.append(norm)
+        y_offset += max((line.box[3] for line in part.lines), default=0)
+    return OCRResult(lines)
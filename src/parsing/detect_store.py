@@ -1,7 +1,12 @@
-def detect_store(ocr_text: str) -> str | None:
-    t = ocr_text.upper()
-    if "WALMART" in t:
-        return "WALMART"
-    if "SAM'S" in t or "SAMS CLUB" in t or "SAM’S" in t:
-        return "SAMS"
-    return None
+from typing import Union
+
+from src.ocr.ocr_result import OCRResult
+from src.parsing.registry import registry
+
+# importing the store modules registers their parsers
+import src.parsing.walmart_parser  # noqa: F401
+import src.parsing.sams_parser  # noqa: F401
+
+
+def detect_store(ocr: Union[OCRResult, str]) -> str | None:
+    return registry.detect(ocr)
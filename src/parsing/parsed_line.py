@@ -0,0 +1,8 @@
+from dataclasses import dataclass
+
+
+@dataclass
+class ParsedLine:
+    raw_name: str
+    amount: float
+    confidence: float = 0.7
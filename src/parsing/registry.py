@@ -0,0 +1,121 @@
+import re
+from dataclasses import dataclass
+from typing import Iterable, Optional, Union
+
+from src.ocr.ocr_result import OCRResult
+from src.parsing.parsed_line import ParsedLine
+
+# Store names/logos are printed at the top; looking only there keeps detection independent of receipt length.
+HEADER_LINES = 12
+
+
+@dataclass(frozen=True)
+class StoreParser:
+    """
+    A store plugin: detection signatures plus a precompiled line grammar.
+
+    item_re must define `name` and `price` groups; lines matching skip_re (totals, payments) are ignored.
+    """
+
+    store: str                      # value stored in receipt_sessions.store
+    signatures: tuple[str, ...]     # literal header markers, matched case-insensitively
+    item_re: re.Pattern
+    skip_re: re.Pattern
+
+    def parse(self, ocr: Union[OCRResult, str]) -> list[ParsedLine]:
+        if isinstance(ocr, str):
+            ocr = OCRResult.from_text(ocr)
+
+        item_match = self.item_re.match
+        skip_search = self.skip_re.search
+        out: list[ParsedLine] = []
+        for line in ocr.lines:
+            text = line.text.strip()
+            if not text or skip_search(text):
+                continue
+            m = item_match(text)
+            if not m:
+                continue
+            name = m.group("name").strip()
+            amount = float(m.group("price").replace(",", "."))
+            conf = line.confidence
+            out.append(ParsedLine(name, amount) if conf is None else ParsedLine(name, amount, conf))
+        return out
+
+
+class ParserRegistry:
+    """
+    Registered store parsers with single-pass detection.
+
+    All signatures are compiled into one alternation with a named group per store, so detection
+    is one regex scan over the header no matter how many stores are registered.
+    """
+
+    def __init__(self, parsers: Iterable[StoreParser] = ()):
+        self._parsers: dict[str, StoreParser] = {}
+        self._detector: Optional[re.Pattern] = None
+        self._group_to_store: dict[str, str] = {}
+        for p in parsers:
+            self.register(p)
+
+    def register(self, parser: StoreParser) -> StoreParser:
+        self._parsers[parser.store] = parser
+        self._detector = None  # rebuilt lazily
+        return parser
+
+    def get(self, store: Optional[str]) -> Optional[StoreParser]:
+        return self._parsers.get(store) if store else None
+
+    @property
+    def stores(self) -> list[str]:
+        return list(self._parsers)
+
+    def detect(self, ocr: Union[OCRResult, str], header_lines: int = HEADER_LINES) -> Optional[str]:
+        """
+        Score every store by signature hits in the header (falling back to the whole text) and return the best.
+        Ties go to the store registered first.
+        """
+        if isinstance(ocr, OCRResult):
+            header = "\n".join(line.text for line in ocr.lines[:header_lines])
+            full = ocr.text if len(ocr.lines) > header_lines else None
+        else:
+            parts = ocr.split("\n", header_lines)
+            header = "\n".join(parts[:header_lines])
+            full = ocr if len(parts) > header_lines else None
+
+        store = self._best(header)
+        if store is None and full is not None:
+            store = self._best(full)
+        return store
+
+    def _best(self, text: str) -> Optional[str]:
+        detector = self._compiled()
+        if detector is None:
+            return None
+        scores: dict[str, int] = {}
+        for m in detector.finditer(text):
+            store = self._group_to_store[m.lastgroup]
+            scores[store] = scores.get(store, 0) + 1
+        if not scores:
+            return None
+        # dicts keep registration order, so max() keeps the first store on ties
+        return max((s for s in self._parsers if s in scores), key=lambda s: scores[s])
+
+    def _compiled(self) -> Optional[re.Pattern]:
+        if self._detector is None and self._parsers:
+            alternatives = []
+            self._group_to_store = {}
+            for i, parser in enumerate(self._parsers.values()):
+                group = f"s{i}"
+                self._group_to_store[group] = parser.store
+                sigs = "|".join(re.escape(sig) for sig in sorted(parser.signatures, key=len, reverse=True))
+                alternatives.append(f"(?P<{group}>{sigs})")
+            self._detector = re.compile("|".join(alternatives), re.IGNORECASE)
+        return self._detector
+
+
+registry = ParserRegistry()
+
+
+def register(parser: StoreParser) -> StoreParser:
+    return registry.register(parser)
@@ -1,17 +1,24 @@
-from dataclasses import dataclass
+import re
+from typing import Union
 
+from src.ocr.ocr_result import OCRResult
+from src.parsing.parsed_line import ParsedLine
+from src.parsing.registry import StoreParser, register
 
-@dataclass
-class ParsedLine:
-    raw_name: str
-    amount: float
-    confidence: float = 0.7
+SAMS = register(StoreParser(
+    store="SAMS",
+    signatures=("SAM'S", "SAM’S", "SAMS CLUB"),
+    # [E] [ITEM NUMBER] NAME PRICE [TAX FLAG], e.g. "E 0980012 MM WHOLE MILK 6.48 N"
+    item_re=re.compile(r"^(?:[A-Z]\s+)?(?:\d{4,14}\s+)?(?P<name>.*?[A-Za-z].*?)\s+\$?(?P<price>-?\d{1,5}[.,]\d{2})(?:\s+[A-Z]{1,2})?$"),
+    skip_re=re.compile(r"\b(SUB\s*TOTAL|TOTAL|TAX|IVA|CHANGE|CAMBIO|CASH|EFECTIVO|DEBIT|CREDIT|VISA|MASTERCARD|MEMBER|SOCIO|SAVINGS)\b", re.IGNORECASE),
+))
 
 
-def parse_sams(ocr_text: str) -> list[ParsedLine]:
+def parse_sams(ocr: Union[OCRResult, str]) -> list[ParsedLine]:
     """
     Extract item lines for Sam's Club receipts.
 
-    Placeholder: implement store-specific parsing.
+    Same heuristics as Walmart, but item numbers come before the name.
+    Confidence comes from the OCR line when the engine reports one.
     """
-    raise NotImplementedError("Implement Sam's parsing logic")
+    return SAMS.parse(ocr)
@@ -1,20 +1,26 @@
-from dataclasses import dataclass
+import re
+from typing import Union
 
+from src.ocr.ocr_result import OCRResult
+from src.parsing.parsed_line import ParsedLine
+from src.parsing.registry import StoreParser, register
 
-@dataclass
-class ParsedLine:
-    raw_name: str
-    amount: float
-    confidence: float = 0.7
+WALMART = register(StoreParser(
+    store="WALMART",
+    signatures=("WALMART", "WAL-MART", "WAL*MART"),
+    # NAME [UPC] PRICE [TAX FLAG], e.g. "GV MILK 2PCT 007874235123 3.48 N"
+    item_re=re.compile(r"^(?P<name>.*?[A-Za-z].*?)\s+(?:\d{6,14}\s+)?\$?(?P<price>-?\d{1,5}[.,]\d{2})(?:\s+[A-Z]{1,2})?$"),
+    skip_re=re.compile(r"\b(SUB\s*TOTAL|TOTAL|TAX|IVA|CHANGE|CAMBIO|CASH|EFECTIVO|DEBIT|CREDIT|VISA|MASTERCARD|BALANCE)\b", re.IGNORECASE),
+))
 
 
-def parse_walmart(ocr_text: str) -> list[ParsedLine]:
+def parse_walmart(ocr: Union[OCRResult, str]) -> list[ParsedLine]:
     """
     Extract item lines for Walmart receipts.
 
-    Placeholder:
-    - Implement simple regex heuristics:
-      - Identify lines with a price at the end
-      - Exclude TOTAL/SUBTOTAL/TAX lines
+    Simple regex heuristics:
+    - Identify lines with a price at the end
+    - Exclude TOTAL/SUBTOTAL/TAX lines
+    Confidence comes from the OCR line when the engine reports one.
     """
-    raise NotImplementedError("Implement Walmart parsing logic")
+    return WALMART.parse(ocr)
@@ -0,0 +1,133 @@
+from __future__ import annotations
+import asyncio
+import logging
+import os
+import socket
+import sqlite3
+from typing import Awaitable, Callable, Optional
+
+from src.db.async_repo import AsyncRepo
+from src.pipeline.worker_pool import QueueFullError, ReceiptWorkerPool
+
+log = logging.getLogger(__name__)
+
+JobHandler = Callable[[sqlite3.Row], Awaitable[None]]
+FailureHandler = Callable[[sqlite3.Row, BaseException], Awaitable[None]]
+
+# Errors that a retry cannot fix
+PERMANENT_ERRORS: tuple[type[BaseException], ...] = (NotImplementedError,)
+
+
+class JobRunner:
+    """
+    Feeds durable receipt_jobs rows into the worker pool.
+
+    Jobs are claimed with a lease, run through `handler` (which checkpoints its stages and
+    completes the job), and retried with exponential backoff when it raises. On start all
+    leases are dropped, so jobs interrupted by a crash or restart are picked up again.
+    """
+
+    def __init__(
+        self,
+        repo: AsyncRepo,
+        pool: ReceiptWorkerPool,
+        handler: JobHandler,
+        on_failure: Optional[FailureHandler] = None,
+        lease_s: int = 600,
+        max_attempts: int = 5,
+        backoff_base_s: float = 5.0,
+        poll_s: float = 5.0,
+    ):
+        self.repo = repo
+        self.pool = pool
+        self.handler = handler
+        self.on_failure = on_failure
+        self.lease_s = lease_s
+        self.max_attempts = max_attempts
+        self.backoff_base_s = backoff_base_s
+        self.poll_s = poll_s
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+
+        self.backlog = 0        # open jobs (queued, running or waiting for a retry)
+        self._inflight = 0      # claimed by this process
+        self._wake = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._running: set[asyncio.Task] = set()
+
+    async def start(self) -> None:
+        released = await self.repo.release_job_leases()
+        self.backlog = await self.repo.count_open_jobs()
+        if self.backlog:
+            log.info("resuming %s unfinished receipt jobs (%s were running)", self.backlog, released)
+        self._task = asyncio.create_task(self._loop(), name="job-runner")
+
+    async def stop(self, timeout: float = 10.0) -> None:
+        """
+        Stop claiming jobs, give running ones up to `timeout` seconds to finish, then cancel the rest.
+        Cancelled jobs only lose their lease (no attempt is counted); the next start resumes them.
+        """
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        running = set(self._running)
+        if running:
+            _, unfinished = await asyncio.wait(running, timeout=timeout)
+            for task in unfinished:
+                task.cancel()
+            if unfinished:
+                log.info("interrupted %s running receipt jobs; they resume on the next start", len(unfinished))
+                await asyncio.gather(*unfinished, return_exceptions=True)
+
+    def enqueued(self) -> None:
+        """
+        Call after creating a job so it is picked up right away.
+        """
+        self.backlog += 1
+        self._wake.set()
+
+    async def _loop(self) -> None:
+        while True:
+            self._wake.clear()
+            while self._inflight < self.pool.max_queue:
+                job = await self.repo.claim_job(self.owner, self.lease_s)
+                if job is None:
+                    break
+                self._inflight += 1
+                # tasks start in creation order, so pool.submit keeps per-user order
+                task = asyncio.create_task(self._run(job))
+                self._running.add(task)
+                task.add_done_callback(self._running.discard)
+            try:
+                # also wakes up periodically for retries whose backoff has elapsed
+                await asyncio.wait_for(self._wake.wait(), self.poll_s)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _run(self, job: sqlite3.Row) -> None:
+        try:
+            await self.pool.submit(job["user_id"], lambda: self.handler(job))
+            self.backlog -= 1
+        except QueueFullError:
+            await self.repo.release_job(job["id"])
+        except asyncio.CancelledError:
+            # shutting down: not a failed attempt, leave the job to the next run
+            await self.repo.release_job(job["id"])
+            raise
+        except Exception as e:
+            log.exception("receipt job %s failed", job["id"])
+            gave_up = await self.repo.fail_job(
+                job["id"], repr(e), self.max_attempts, self.backoff_base_s, permanent=isinstance(e, PERMANENT_ERRORS)
+            )
+            if gave_up:
+                self.backlog -= 1
+                if self.on_failure is not None:
+                    try:
+                        await self.on_failure(job, e)
+                    except Exception:
+                        log.exception("failure handler for job %s failed", job["id"])
+        finally:
+            self._inflight -= 1
+            self._wake.set()
@@ -0,0 +1,195 @@
+from __future__ import annotations
+import asyncio
+import contextvars
+import logging
+import threading
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Hashable, Optional, TypeVar
+
+from src.config import PreprocessConfig
+from src.metrics import metrics
+from src.ocr.ocr_engine import ImageInput, OCREngine
+from src.ocr.ocr_result import OCRResult
+
+log = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class QueueFullError(RuntimeError):
+    """Raised by submit() when the pipeline already holds max_queue jobs."""
+
+
+@dataclass
+class PoolStats:
+    queued: int = 0            # accepted, waiting for a free slot or for the user's previous job
+    running: int = 0
+    completed: int = 0
+    failed: int = 0
+    rejected: int = 0
+    total_latency_s: float = 0.0
+    max_latency_s: float = 0.0
+
+    @property
+    def depth(self) -> int:
+        return self.queued + self.running
+
+    @property
+    def avg_latency_s(self) -> float:
+        done = self.completed + self.failed
+        return self.total_latency_s / done if done else 0.0
+
+
+@dataclass
+class OCRRun:
+    result: OCRResult
+    timings: dict[str, float]   # preprocess steps + "ocr", seconds
+
+
+def preprocess_and_ocr(ocr: OCREngine, image: ImageInput, preprocess: Optional[PreprocessConfig]) -> OCRRun:
+    timings: dict[str, float] = {}
+    if preprocess is not None and preprocess.enabled:
+        from src.ocr.preprocess import preprocess_image
+
+        if isinstance(image, Path):
+            image = image.read_bytes()
+        pre = preprocess_image(image, preprocess)
+        image = pre.data
+        timings.update(pre.timings)
+    t0 = time.perf_counter()
+    result = ocr.extract(image)
+    timings["ocr"] = time.perf_counter() - t0
+    return OCRRun(result=result, timings=timings)
+
+
+# ---------- OCR worker process ----------
+_worker_ocr: Optional[OCREngine] = None
+
+
+def init_ocr_worker(ocr_factory: Callable[[], OCREngine]) -> None:
+    global _worker_ocr
+    _worker_ocr = ocr_factory()
+
+
+def ocr_in_worker(image: ImageInput, preprocess: Optional[PreprocessConfig]) -> OCRRun:
+    return preprocess_and_ocr(_worker_ocr, image, preprocess)
+
+
+class ReceiptWorkerPool:
+    """
+    Runs receipt jobs off the Telegram event loop.
+
+    - OCR (CPU bound) goes to a process pool; with ocr_processes=0 it runs in the thread pool instead.
+    - Everything else (DB, export, file I/O) goes to the thread pool.
+    - At most max_queue jobs are accepted at once; submit() raises QueueFullError beyond that.
+    - Jobs with the same key (user) run strictly in submission order.
+    - At most max_concurrent jobs run at the same time across all users.
+    """
+
+    def __init__(
+        self,
+        ocr_factory: Callable[[], OCREngine] = OCREngine,
+        ocr_processes: int = 2,
+        io_threads: int = 4,
+        max_queue: int = 20,
+        max_concurrent: Optional[int] = None,
+    ):
+        self.max_queue = max_queue
+        self.stats = PoolStats()
+
+        self._io: Executor = ThreadPoolExecutor(max_workers=io_threads, thread_name_prefix="receipt-io")
+        if ocr_processes > 0:
+            self._ocr_executor: Executor = ProcessPoolExecutor(
+                max_workers=ocr_processes,
+                initializer=init_ocr_worker,
+                initargs=(ocr_factory,),
+            )
+        else:
+            self._ocr_executor = self._io
+        self._ocr_factory = ocr_factory if ocr_processes <= 0 else None
+        self._local_ocr: Optional[OCREngine] = None   # created by the first in-process OCR
+        self._local_ocr_lock = threading.Lock()
+
+        self._slots = asyncio.Semaphore(max_concurrent or max(ocr_processes, 1) + io_threads)
+        self._tails: dict[Hashable, asyncio.Future] = {}
+
+    # ---------- stages ----------
+    async def run_ocr(self, image: ImageInput, preprocess: Optional[PreprocessConfig] = None) -> OCRRun:
+        """
+        Preprocess (if configured) and OCR an image in the OCR executor; bytes stay in memory end to end.
+        """
+        loop = asyncio.get_running_loop()
+        if self._ocr_factory is not None:
+            run = await loop.run_in_executor(self._ocr_executor, self._ocr_locally, image, preprocess)
+        else:
+            run = await loop.run_in_executor(self._ocr_executor, ocr_in_worker, image, preprocess)
+        for step, seconds in run.timings.items():
+            metrics.observe(step if step == "ocr" else f"preprocess.{step}", seconds)
+        return run
+
+    def _ocr_locally(self, image: ImageInput, preprocess: Optional[PreprocessConfig]) -> OCRRun:
+        with self._local_ocr_lock:
+            if self._local_ocr is None:
+                self._local_ocr = self._ocr_factory()
+        return preprocess_and_ocr(self._local_ocr, image, preprocess)
+
+    async def run_io(self, fn: Callable[..., T], *args: Any) -> T:
+        loop = asyncio.get_running_loop()
+        # carry context vars (the current metrics trace) into the worker thread
+        ctx = contextvars.copy_context()
+        return await loop.run_in_executor(self._io, lambda: ctx.run(fn, *args))
+
+    # ---------- jobs ----------
+    async def submit(self, key: Hashable, job: Callable[[], Awaitable[T]]) -> T:
+        """
+        Queue job() behind any earlier job for the same key and await its result.
+        """
+        if self.stats.depth >= self.max_queue:
+            self.stats.rejected += 1
+            raise QueueFullError(f"queue full ({self.max_queue} jobs)")
+
+        prev = self._tails.get(key)
+        done: asyncio.Future = asyncio.get_running_loop().create_future()
+        self._tails[key] = done
+
+        self.stats.queued += 1
+        started = time.perf_counter()
+        waiting = True
+        try:
+            if prev is not None:
+                await asyncio.shield(prev)
+            async with self._slots:
+                waiting = False
+                metrics.observe("queue_wait", time.perf_counter() - started)
+                self.stats.queued -= 1
+                self.stats.running += 1
+                try:
+                    result = await job()
+                except BaseException:
+                    self.stats.failed += 1
+                    raise
+                else:
+                    self.stats.completed += 1
+                    return result
+                finally:
+                    self.stats.running -= 1
+                    self._record_latency(time.perf_counter() - started)
+        finally:
+            if waiting:
+                self.stats.queued -= 1
+            done.set_result(None)
+            if self._tails.get(key) is done:
+                del self._tails[key]
+
+    def _record_latency(self, elapsed: float) -> None:
+        self.stats.total_latency_s += elapsed
+        if elapsed > self.stats.max_latency_s:
+            self.stats.max_latency_s = elapsed
+
+    def shutdown(self) -> None:
+        if self._ocr_executor is not self._io:
+            self._ocr_executor.shutdown(wait=True, cancel_futures=True)
+        self._io.shutdown(wait=True, cancel_futures=True)
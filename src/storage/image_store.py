@@ -0,0 +1,117 @@
+import io
+import logging
+import os
+import tempfile
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional
+
+from src.config import StorageConfig
+from src.db.repo import Repo
+from src.ocr.ocr_cache import image_sha256
+
+log = logging.getLogger(__name__)
+
+
+@dataclass
+class PruneResult:
+    files: int = 0
+    bytes: int = 0
+
+
+class ImageStore:
+    """
+    Receipt photos stored once per content hash under `root/<sha[:2]>/<sha>`.
+
+    The stored_images table tracks size and age, so archiving and pruning never walk the directory.
+    Files have no extension: archive() may re-encode one in place (the format is in the bytes),
+    which keeps receipt_sessions.image_path valid.
+    """
+
+    def __init__(self, repo: Repo, root: Path, cfg: StorageConfig):
+        self.repo = repo
+        self.root = root
+        self.cfg = cfg
+
+    def path_for(self, sha: str) -> Path:
+        return self.root / sha[:2] / sha
+
+    def put(self, data: bytes, sha: Optional[str] = None) -> Path:
+        """
+        Store the image unless the same content is already there. Returns its path.
+        """
+        sha = sha or image_sha256(data)
+        path = self.path_for(sha)
+        if self.repo.get_stored_image(sha) is not None and path.exists():
+            return path
+        _write_atomic(path, data)
+        self.repo.put_stored_image(sha, str(path), len(data))
+        return path
+
+    def archive(self, sha: str) -> bool:
+        """
+        Re-encode a processed image into the compact archive format (smaller, OCR is done with it).
+        Returns False if it was already archived, is gone, or re-encoding would not make it smaller.
+        """
+        if not self.cfg.archive:
+            return False
+        row = self.repo.get_stored_image(sha)
+        if row is None or row["archived"]:
+            return False
+        path = Path(row["path"])
+        try:
+            data = path.read_bytes()
+        except FileNotFoundError:
+            self.repo.delete_stored_images([sha])
+            return False
+
+        from PIL import Image, ImageOps
+
+        img = ImageOps.exif_transpose(Image.open(io.BytesIO(data)))
+        if img.mode not in ("L", "RGB"):
+            img = img.convert("RGB")
+        if self.cfg.archive_max_width and img.width > self.cfg.archive_max_width:
+            height = max(1, round(img.height * self.cfg.archive_max_width / img.width))
+            img = img.resize((self.cfg.archive_max_width, height), Image.Resampling.LANCZOS)
+        buf = io.BytesIO()
+        img.save(buf, format=self.cfg.archive_format, quality=self.cfg.archive_quality)
+        encoded = buf.getvalue()
+
+        if len(encoded) < len(data):
+            _write_atomic(path, encoded)
+            size = len(encoded)
+        else:
+            size = len(data)
+        self.repo.mark_stored_image_archived(sha, size)
+        return size < len(data)
+
+    def prune(self) -> PruneResult:
+        """
+        Delete images older than max_age_days, then the oldest until the store fits in max_mb.
+        Sessions that pointed at a deleted image get image_path NULL.
+        """
+        rows = self.repo.stored_images_to_prune(self.cfg.max_age_days, self.cfg.max_mb * 1024 * 1024)
+        result = PruneResult()
+        for row in rows:
+            try:
+                os.unlink(row["path"])
+            except FileNotFoundError:
+                pass
+            result.files += 1
+            result.bytes += row["size_bytes"]
+        if rows:
+            self.repo.delete_stored_images([row["image_sha256"] for row in rows])
+            log.info("pruned %s stored images (%.1f MB)", result.files, result.bytes / 1024 / 1024)
+        return result
+
+
+def _write_atomic(path: Path, data: bytes) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise